@@ -0,0 +1,425 @@
+'''
+Офлайн-бенчмарк seo-analyzer на синтетическом корпусе страниц в разметке OpenCart.
+
+Страницы из corpus/ раздает локальный HTTP-сервер (ссылки на магазины
+переписываются на него), там же работает заглушка OpenAI с настраиваемой
+задержкой. Для каждой страницы считаются страницы/с, CPU по этапам
+(загрузка, разбор, AI), пиковая память и совпадение извлеченных полей
+с эталоном corpus/expected.json.
+
+    python backend/bench/bench_seo_analyzer.py --repeat 20 --json base.json
+    python backend/bench/bench_seo_analyzer.py --repeat 20 --compare base.json
+    python backend/bench/bench_seo_analyzer.py --update-expected
+'''
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+ANALYZER_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'seo-analyzer')
+EXPECTED_PATH = os.path.join(CORPUS_DIR, 'expected.json')
+
+SHOP_URL_RE = re.compile(r'https://[a-z0-9-]+\.example/')
+# Колебания пиковой памяти меньше этого порога считаются шумом
+MEMORY_NOISE_KB = 64
+
+REPEAT_RE = re.compile(r'<!-- bench:repeat -->(.*?)<!-- /bench:repeat -->', re.DOTALL)
+
+STUB_ANALYSIS = {
+    'full_name': 'Тестовый товар',
+    'description': 'Описание товара от заглушки OpenAI.',
+    'key_features': ['Особенность 1', 'Особенность 2'],
+    'advantages': ['Преимущество 1'],
+    'specifications': {'Общие': {'Параметр': 'Значение'}},
+    'visual_details': {'color': 'Черный', 'material': 'Пластик', 'form_factor': 'Моноблок'},
+    'target_audience': 'Все',
+    'use_cases': ['Повседневное использование'],
+    'seo_meta': {'title': 'Тестовый товар', 'description': 'Купить тестовый товар', 'h1': 'Тестовый товар', 'keywords': ['товар']},
+    'lsi_phrases': ['тестовый товар купить'],
+    'selling_points': ['Гарантия']
+}
+
+
+def inflate(html: str, target_mb: float) -> str:
+    '''Повторяет блок bench:repeat, пока страница не достигнет target_mb'''
+    match = REPEAT_RE.search(html)
+    if not match:
+        return html
+    block = match.group(1)
+    copies = max(int((target_mb * 1024 * 1024 - len(html.encode('utf-8'))) / len(block.encode('utf-8'))), 1)
+    return html[:match.start(1)] + block * copies + html[match.end(1):]
+
+
+def load_corpus(include_large: bool = True) -> List[dict]:
+    with open(os.path.join(CORPUS_DIR, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    pages = []
+    for entry in manifest['pages']:
+        with open(os.path.join(CORPUS_DIR, entry['file']), encoding='utf-8') as f:
+            html = f.read()
+        pages.append({**entry, 'html': html})
+        if include_large and entry.get('large_mb'):
+            pages.append({
+                **entry,
+                'name': f"{entry['name']}_large",
+                'path': f"{entry['path']}-large",
+                'html': inflate(html, entry['large_mb'])
+            })
+    return pages
+
+
+class CorpusHTTPServer(ThreadingHTTPServer):
+    # Нагрузочный тест открывает сотни соединений одновременно
+    request_queue_size = 512
+
+
+class CorpusServer:
+    '''Локальная замена магазинов и OpenAI API'''
+
+    def __init__(self, pages: List[dict], ai_latency: float = 0.0):
+        self.ai_latency = ai_latency
+        self.httpd = CorpusHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+        self.routes = {
+            page['path']: SHOP_URL_RE.sub(self.base_url, page['html']).encode('utf-8')
+            for page in pages
+        }
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # Параметры запроса не важны: нагрузочный тест делает URL уникальными через ?v=N
+                body = server.routes.get(self.path.split('?', 1)[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if server.ai_latency:
+                    time.sleep(server.ai_latency)
+                body = json.dumps({
+                    'id': 'chatcmpl-bench',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': 'gpt-4o-mini',
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': json.dumps(STUB_ANALYSIS, ensure_ascii=False)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {'prompt_tokens': 4000, 'completion_tokens': 800, 'total_tokens': 4800}
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StageClock:
+    '''Время этапов на вызывающем потоке: загрузка страниц и AI-запрос, остальное — разбор'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.wall = {'fetch': 0.0, 'ai': 0.0}
+        self.cpu = {'fetch': 0.0, 'ai': 0.0}
+
+    def timed(self, stage: str, fn):
+        clock = self
+
+        def wrapper(*args, **kwargs):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                result = fn(*args, **kwargs)
+                if stage == 'fetch':
+                    return TimedResponse(result, clock)
+                return result
+            finally:
+                clock.wall[stage] += time.perf_counter() - wall
+                clock.cpu[stage] += time.thread_time() - cpu
+
+        return wrapper
+
+
+class TimedResponse:
+    def __init__(self, response, clock: StageClock):
+        self.response = response
+        self.clock = clock
+
+    def read(self, *args):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return self.response.read(*args)
+        finally:
+            self.clock.wall['fetch'] += time.perf_counter() - wall
+            self.clock.cpu['fetch'] += time.thread_time() - cpu
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self.response.__exit__(*exc)
+
+
+def load_analyzer(clock: StageClock, use_ai: bool):
+    sys.path.insert(0, ANALYZER_DIR)
+    import index
+    import ai_analyzer
+
+    use_ai = use_ai and ai_analyzer.OPENAI_AVAILABLE
+
+    urllib.request.urlopen = clock.timed('fetch', urllib.request.urlopen)
+    if use_ai:
+        index.analyze_product_with_ai = clock.timed('ai', index.analyze_product_with_ai)
+    else:
+        index.analyze_product_with_ai = lambda html, basic_data: None
+    return index
+
+
+def run_page(index, page: dict, base_url: str) -> dict:
+    url = base_url.rstrip('/') + page['path']
+    if page['kind'] == 'product':
+        result = index.analyze_product_page(url)
+        data = result['basic_data']
+        return {
+            'product_name': data['product_name'],
+            'brand': data['brand'],
+            'price': data['price'],
+            'description': data['description'],
+            'specifications': data['specifications'],
+            'brand_page_url': result['brand_page_url'].replace(base_url, '/'),
+            'brand_page_info': result['brand_page_info']
+        }
+    if page['kind'] == 'category':
+        result = index.analyze_category_page(url)
+        index.generate_category_description(result, page.get('category_name', ''))
+        return {
+            'brands': sorted(result['brands']),
+            'page_title': result['page_title'],
+            'h1': result['h1'],
+            'keywords': result['keywords'],
+            'products': len(result['products']),
+            'total_products': result['total_products']
+        }
+    return {'brand_info': index.extract_brand_info_from_page(url)}
+
+
+def run_parser(index, page: dict) -> dict:
+    parser = index.ProductParser()
+    parser.feed(page['html'])
+    return {'products': len(parser.products), 'brands': sorted(parser.brands)}
+
+
+def measure(label: str, fn, clock: StageClock, repeat: int, expected: Optional[dict]) -> dict:
+    fn()  # прогрев: импорты, компиляция регулярных выражений
+
+    durations = []
+    cpu_times = []
+    clock.reset()
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        output = fn()
+        durations.append(time.perf_counter() - wall)
+        cpu_times.append(time.thread_time() - cpu)
+
+    # Медианы устойчивее к единичным паузам GC и планировщика, чем средние
+    stage_cpu = {stage: value / repeat for stage, value in clock.cpu.items()}
+    stage_cpu['parse'] = max(statistics.median(cpu_times) - sum(stage_cpu.values()), 0.0)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Числа с плавающей точкой и порядок ключей не мешают сравнению
+    output = json.loads(json.dumps(output, ensure_ascii=False))
+    mismatches = []
+    if expected is not None:
+        mismatches = sorted(key for key in set(expected) | set(output) if expected.get(key) != output.get(key))
+
+    return {
+        'name': label,
+        'repeat': repeat,
+        'pages_per_s': 1 / statistics.median(durations),
+        'wall_ms_median': statistics.median(durations) * 1000,
+        'wall_ms_p95': sorted(durations)[max(int(len(durations) * 0.95) - 1, 0)] * 1000,
+        'cpu_ms': {stage: value * 1000 for stage, value in stage_cpu.items()},
+        'peak_kb': peak / 1024,
+        'parity': 'n/a' if expected is None else ('ok' if not mismatches else 'mismatch'),
+        'mismatches': mismatches,
+        'output': output
+    }
+
+
+def print_report(results: List[dict]) -> None:
+    print(f"{'page':32} {'pages/s':>9} {'med ms':>8} {'p95 ms':>8} {'fetch':>7} {'parse':>7} {'ai':>7} {'peak KB':>9}  parity")
+    for r in results:
+        cpu = r['cpu_ms']
+        print(
+            f"{r['name']:32} {r['pages_per_s']:9.1f} {r['wall_ms_median']:8.2f} {r['wall_ms_p95']:8.2f} "
+            f"{cpu.get('fetch', 0):7.2f} {cpu.get('parse', 0):7.2f} {cpu.get('ai', 0):7.2f} {r['peak_kb']:9.0f}  "
+            f"{r['parity']}{' ' + ','.join(r['mismatches']) if r['mismatches'] else ''}"
+        )
+    total_time = sum(1 / r['pages_per_s'] for r in results)
+    print(f"\nИтого: {len(results) / total_time:.1f} страниц/с по медианам (CPU-этапы в мс на страницу)")
+
+
+def compare(base: dict, current: dict, threshold: float) -> bool:
+    '''Сравнивает два прогона; True, если найдена регрессия'''
+    base_by_name = {r['name']: r for r in base['results']}
+    regressed = False
+
+    print(f"\n{'page':32} {'pages/s':>18} {'cpu ms':>18} {'peak KB':>18}")
+    for r in current['results']:
+        old = base_by_name.get(r['name'])
+        if old is None:
+            continue
+        old_cpu, new_cpu = sum(old['cpu_ms'].values()), sum(r['cpu_ms'].values())
+        speed = r['pages_per_s'] / old['pages_per_s'] - 1
+        cpu = new_cpu / old_cpu - 1 if old_cpu else 0.0
+        memory = r['peak_kb'] / old['peak_kb'] - 1 if old['peak_kb'] else 0.0
+
+        flags = []
+        if speed < -threshold:
+            flags.append('SLOWER')
+        if cpu > threshold:
+            flags.append('CPU')
+        if memory > threshold and r['peak_kb'] - old['peak_kb'] > MEMORY_NOISE_KB:
+            flags.append('MEMORY')
+        if old['output'] != r['output']:
+            flags.append('OUTPUT CHANGED')
+        regressed = regressed or bool(flags)
+
+        print(
+            f"{r['name']:32} {old['pages_per_s']:8.1f} {speed:+8.1%} {new_cpu:9.2f} {cpu:+8.1%} "
+            f"{r['peak_kb']:9.0f} {memory:+8.1%}  {' '.join(flags)}"
+        )
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='итераций на страницу')
+    parser.add_argument('--ai-latency', type=float, default=0.0, help='задержка заглушки OpenAI, секунд')
+    parser.add_argument('--no-ai', action='store_true', help='не вызывать AI-анализ')
+    parser.add_argument('--no-large', action='store_true', help='пропустить многомегабайтные страницы')
+    parser.add_argument('--only', help='регулярное выражение по имени страницы')
+    parser.add_argument('--json', help='сохранить результаты прогона в файл')
+    parser.add_argument('--compare', help='сравнить с сохраненным прогоном')
+    parser.add_argument('--threshold', type=float, default=0.20, help='допустимое ухудшение (доля)')
+    parser.add_argument('--update-expected', action='store_true', help='перезаписать эталон извлеченных полей')
+    args = parser.parse_args()
+
+    pages = load_corpus(include_large=not args.no_large)
+    if args.only:
+        pages = [page for page in pages if re.search(args.only, page['name'])]
+
+    expected: Dict[str, dict] = {}
+    if os.path.exists(EXPECTED_PATH) and not args.update_expected:
+        with open(EXPECTED_PATH, encoding='utf-8') as f:
+            expected = json.load(f)
+
+    with CorpusServer(pages, args.ai_latency) as server:
+        os.environ['OPENAI_API_KEY'] = 'bench'
+        os.environ['OPENAI_BASE_URL'] = server.base_url + 'v1'
+        # Повторы одной страницы иначе отвечали бы из индекса вариантов
+        # и отпечатков без разбора и AI-вызова
+        os.environ['SEO_VARIANT_REUSE'] = '0'
+        os.environ['SEO_INCREMENTAL'] = '0'
+        # Корпус раздает локальный сервер: лимиты вежливости измеряли бы паузы, а не разбор
+        os.environ['CRAWL_HOST_RPS'] = '0'
+        os.environ['CRAWL_ROBOTS'] = '0'
+
+        clock = StageClock()
+        index = load_analyzer(clock, use_ai=not args.no_ai)
+
+        results = []
+        for page in pages:
+            results.append(measure(
+                page['name'],
+                lambda page=page: run_page(index, page, server.base_url),
+                clock, args.repeat, expected.get(page['name'])
+            ))
+            if page['kind'] == 'category':
+                name = f"parser:{page['name']}"
+                results.append(measure(
+                    name, lambda page=page: run_parser(index, page),
+                    clock, args.repeat, expected.get(name)
+                ))
+
+    print_report(results)
+
+    run = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'ai': index.analyze_product_with_ai.__name__ == 'wrapper',
+        'results': results
+    }
+
+    if args.update_expected:
+        with open(EXPECTED_PATH, 'w', encoding='utf-8') as f:
+            json.dump({r['name']: r['output'] for r in results}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f'\nЭталон обновлен: {EXPECTED_PATH}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(run, f, ensure_ascii=False, indent=2)
+
+    failed = any(r['parity'] == 'mismatch' for r in results)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            failed = compare(json.load(f), run, args.threshold) or failed
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # Анализатор берет бренды из множества и обрезает список, поэтому результат
+    # зависит от порядка хешей; фиксируем его, чтобы сравнение прогонов было честным
+    if os.environ.get('PYTHONHASHSEED') != '0':
+        os.environ['PYTHONHASHSEED'] = '0'
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+    sys.exit(main())
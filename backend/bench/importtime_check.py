@@ -0,0 +1,135 @@
+'''
+Проверка холодного старта функций: время импорта index и тяжелые модули.
+
+Для каждой функции в чистом интерпретаторе выполняется `python -X importtime`
+с импортом index и обработкой preflight-запроса (OPTIONS). Скрипт печатает
+самые дорогие импорты и завершается с кодом 1, если медианное время импорта
+превысило бюджет или при старте загрузился модуль, который должен
+импортироваться только по требованию (openai, requests, boto3, Pillow).
+
+    python backend/bench/importtime_check.py
+    python backend/bench/importtime_check.py --budget-ms 80 --top 15
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые не должны грузиться при старте функции
+FUNCTIONS = {
+    'seo-analyzer': ['openai', 'requests'],
+    'media-generate': ['requests', 'boto3', 'botocore', 'PIL', 'openai'],
+}
+
+PROBE = '''
+import sys
+import index
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+print(','.join(name for name in sys.argv[1:] if name in sys.modules))
+'''
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    '''Строки вида "import time: self [us] | cumulative | module" -> (module, self_us, cumulative_us)'''
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        entries.append((parts[2].rstrip(), int(parts[0]), int(parts[1])))
+    return entries
+
+
+def probe(function_dir: str, forbidden: List[str], state_dir: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+    env = dict(os.environ)
+    env['MEDIA_STATE_DB'] = os.path.join(state_dir, 'media-generate.sqlite3')
+    env['SEO_STATE_DIR'] = state_dir
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, *forbidden],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'{function_dir}: import failed\n{result.stderr[-2000:]}')
+    output = result.stdout.strip().splitlines()
+    loaded = [name for name in output[-1].split(',') if name] if output else []
+    return parse_importtime(result.stderr), loaded
+
+
+def index_imports(entries: List[Tuple[str, int, int]]) -> Tuple[float, Dict[str, int]]:
+    '''
+    Время импорта index (мс) и накопленное время его вложенных импортов.
+
+    importtime печатает модуль после всех его зависимостей, с отступом по
+    глубине вложенности, поэтому зависимости index — строки перед ним
+    с отступом больше, чем у самого index.
+    '''
+    for position, (module, _, cumulative_us) in enumerate(entries):
+        if module.strip() != 'index':
+            continue
+        depth = len(module) - len(module.lstrip())
+        nested: Dict[str, int] = {}
+        for child, _, child_us in reversed(entries[:position]):
+            if len(child) - len(child.lstrip()) <= depth:
+                break
+            nested[child.strip()] = max(nested.get(child.strip(), 0), child_us)
+        return cumulative_us / 1000, nested
+    return 0.0, {}
+
+
+def check_function(name: str, forbidden: List[str], repeat: int, top: int, budget_ms: float) -> List[str]:
+    function_dir = os.path.join(BACKEND_DIR, name)
+    timings: List[float] = []
+    loaded: List[str] = []
+    nested: Dict[str, int] = {}
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        for _ in range(repeat):
+            entries, loaded = probe(function_dir, forbidden, state_dir)
+            elapsed_ms, nested = index_imports(entries)
+            timings.append(elapsed_ms)
+
+    median_ms = statistics.median(timings)
+    print(f'\n{name}: import index {median_ms:.1f} мс (медиана из {repeat}, бюджет {budget_ms:.0f} мс)')
+    for module, cumulative_us in sorted(nested.items(), key=lambda item: -item[1])[:top]:
+        print(f'  {cumulative_us / 1000:8.2f} мс  {module}')
+
+    problems = []
+    if median_ms > budget_ms:
+        problems.append(f'{name}: импорт {median_ms:.1f} мс превышает бюджет {budget_ms:.0f} мс')
+    if loaded:
+        problems.append(f'{name}: при старте загружены {", ".join(loaded)}')
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='запусков интерпретатора на функцию')
+    parser.add_argument('--top', type=int, default=10, help='сколько самых дорогих импортов показать')
+    parser.add_argument('--budget-ms', type=float, default=150.0, help='допустимое время импорта index, мс')
+    parser.add_argument('--only', choices=sorted(FUNCTIONS), help='проверить одну функцию')
+    args = parser.parse_args()
+
+    problems = []
+    for name, forbidden in FUNCTIONS.items():
+        if args.only and name != args.only:
+            continue
+        problems.extend(check_function(name, forbidden, args.repeat, args.top, args.budget_ms))
+
+    if problems:
+        print('\nПроблемы холодного старта:')
+        for problem in problems:
+            print(f'  - {problem}')
+        return 1
+    print('\nХолодный старт в норме')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
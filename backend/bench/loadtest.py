@@ -0,0 +1,252 @@
+'''
+Нагрузочный тест локального сервера функций (backend/server.py).
+
+Без --url поднимает корпус страниц из bench_seo_analyzer (магазины и заглушка
+OpenAI) и backend/server.py seo-analyzer в отдельном процессе, затем держит
+--concurrency одновременных keep-alive соединений. Отчет: запросы в секунду,
+задержки (p50/p95/p99), коды ответов и состояние сервера из /healthz.
+
+    python backend/bench/loadtest.py --scenario product -c 200 -n 5000
+    python backend/bench/loadtest.py --scenario category --workers 128 --duration 30
+    python backend/bench/loadtest.py --url http://127.0.0.1:8001/ --body '{"type": "stats"}'
+'''
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_PATH = os.path.join(os.path.dirname(BENCH_DIR), 'server.py')
+STARTUP_TIMEOUT = 30
+
+sys.path.insert(0, BENCH_DIR)
+from bench_seo_analyzer import CorpusServer, load_corpus  # noqa: E402
+
+
+def scenario_bodies(scenario: str, pages: List[dict], base_url: str) -> Callable[[int], bytes]:
+    '''Тело i-го запроса; ?v=N делает URL уникальными, иначе одинаковые анализы объединились бы'''
+    def url(kind: str, i: int) -> str:
+        candidates = [page for page in pages if page['kind'] == kind]
+        page = candidates[i % len(candidates)]
+        return f"{base_url.rstrip('/')}{page['path']}?v={i}"
+
+    if scenario == 'product':
+        return lambda i: json.dumps({'type': 'product', 'productUrl': url('product', i)}).encode('utf-8')
+    if scenario == 'category':
+        return lambda i: json.dumps({
+            'type': 'category', 'categoryUrl': url('category', i), 'categoryName': 'Смартфоны'
+        }).encode('utf-8')
+    return lambda i: b'{"type": "stats"}'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(base_url: str, process: subprocess.Popen) -> None:
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Сервер завершился с кодом {process.returncode}')
+        try:
+            with urllib.request.urlopen(base_url + 'healthz', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit('Сервер не ответил на /healthz')
+
+
+def healthz(base_url: str) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(base_url + 'healthz', timeout=5) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+class LoadRunner:
+    def __init__(self, url: str, method: str, body: Callable[[int], bytes],
+                 concurrency: int, total: int, duration: float, timeout: float):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.method = method
+        self.body = body
+        self.concurrency = concurrency
+        self.total = total
+        self.duration = duration
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.deadline = 0.0
+
+    def next_index(self) -> Optional[int]:
+        with self.lock:
+            if self.duration and time.perf_counter() >= self.deadline:
+                return None
+            if not self.duration and self.issued >= self.total:
+                return None
+            self.issued += 1
+            return self.issued - 1
+
+    def worker(self) -> None:
+        connection = None
+        while True:
+            i = self.next_index()
+            if i is None:
+                break
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                connection.request(self.method, self.path, body=self.body(i),
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                status = str(response.status)
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                if connection is not None:
+                    connection.close()
+                connection = None
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.latencies.append(elapsed)
+                self.statuses[status] += 1
+        if connection is not None:
+            connection.close()
+
+    def run(self) -> Dict:
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        self.deadline = started + self.duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+        return {
+            'requests': len(latencies),
+            'concurrency': self.concurrency,
+            'wall_s': round(wall, 2),
+            'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+                'p50': round(percentile(0.50), 1),
+                'p95': round(percentile(0.95), 1),
+                'p99': round(percentile(0.99), 1),
+                'max': round(latencies[-1] * 1000, 1) if latencies else 0.0
+            },
+            'statuses': dict(self.statuses)
+        }
+
+
+def print_report(report: Dict) -> None:
+    latency = report['latency_ms']
+    print(f"\nЗапросов: {report['requests']} за {report['wall_s']} с, соединений: {report['concurrency']}")
+    print(f"Пропускная способность: {report['rps']} запросов/с")
+    print(f"Задержка, мс: среднее {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  макс {latency['max']}")
+    print('Ответы: ' + ', '.join(f'{status}: {count}' for status, count in sorted(report['statuses'].items())))
+    if report.get('server'):
+        print(f"Сервер: {json.dumps(report['server'], ensure_ascii=False)}")
+
+
+def run_local(args: argparse.Namespace) -> Dict:
+    '''Корпус и backend/server.py seo-analyzer на свободном порту на время теста'''
+    pages = load_corpus(include_large=False)
+    with CorpusServer(pages, args.ai_latency) as corpus, tempfile.TemporaryDirectory() as state_dir:
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}/'
+        env = {
+            **os.environ,
+            # Те же условия, что и в bench_seo_analyzer: без индекса вариантов, отпечатков
+            # и лимитов вежливости, иначе тест мерил бы паузы, а не обработку
+            'SEO_VARIANT_REUSE': '0',
+            'SEO_INCREMENTAL': '0',
+            'CRAWL_HOST_RPS': '0',
+            'CRAWL_ROBOTS': '0',
+            'CRAWL_HOST_CONCURRENCY': str(args.workers),
+            'SEO_STATE_DIR': state_dir
+        }
+        if args.ai_latency:
+            env.update({'OPENAI_API_KEY': 'bench', 'OPENAI_BASE_URL': corpus.base_url + 'v1'})
+
+        process = subprocess.Popen(
+            [sys.executable, SERVER_PATH, 'seo-analyzer', '--port', str(port), '--workers', str(args.workers)],
+            env=env, stdout=subprocess.DEVNULL
+        )
+        try:
+            wait_healthy(base_url, process)
+            runner = LoadRunner(base_url, 'POST', scenario_bodies(args.scenario, pages, corpus.base_url),
+                                args.concurrency, args.requests, args.duration, args.timeout)
+            report = runner.run()
+            report['scenario'] = args.scenario
+            report['server'] = healthz(base_url)
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='уже запущенный сервер; без него поднимается корпус и seo-analyzer')
+    parser.add_argument('--scenario', choices=('product', 'category', 'stats'), default='product',
+                        help='тело запросов к поднятому seo-analyzer')
+    parser.add_argument('--method', default='POST')
+    parser.add_argument('--body', help='тело запроса для --url (JSON)')
+    parser.add_argument('-c', '--concurrency', type=int, default=100, help='одновременных соединений')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='всего запросов')
+    parser.add_argument('--duration', type=float, default=0.0, help='длительность, секунд (вместо -n)')
+    parser.add_argument('--workers', type=int, default=64, help='потоков сервера (без --url)')
+    parser.add_argument('--ai-latency', type=float, default=0.0, help='задержка заглушки OpenAI, секунд')
+    parser.add_argument('--timeout', type=float, default=60.0, help='таймаут запроса, секунд')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    if args.url:
+        body = (args.body or '').encode('utf-8')
+        runner = LoadRunner(args.url, args.method, lambda i: body, args.concurrency,
+                            args.requests, args.duration, args.timeout)
+        report = runner.run()
+        report['server'] = healthz(urllib.parse.urljoin(args.url, '/'))
+    else:
+        report = run_local(args)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List
+
+# Лимиты DALL-E 3 зависят от тарифа OpenAI (images per minute)
+DALLE_RPM = max(int(os.environ.get('DALLE_RPM', '5')), 1)
+DALLE_CONCURRENCY = max(int(os.environ.get('DALLE_CONCURRENCY', '4')), 1)
+# Пакет отдается одним ответом, поэтому должен успеть целиком за таймаут функции:
+# всплеск из DALLE_RPM генераций плюс DALLE_RPM в минуту, с запасом на последнюю
+FUNCTION_TIMEOUT = float(os.environ.get('MEDIA_FUNCTION_TIMEOUT', '300'))
+GENERATION_RESERVE = 30.0
+MAX_BATCH_SIZE = max(min(int(DALLE_RPM * (1 + max(FUNCTION_TIMEOUT - GENERATION_RESERVE, 0) / 60)), 100), 1)
+
+
+class RateLimiter:
+    '''Token bucket: не более rate запросов за period секунд с учетом всплеска до rate'''
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.fill_rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+# Общий для процесса лимитер: одиночные запросы и пакеты делят одну квоту
+dalle_limiter = RateLimiter(DALLE_RPM)
+
+
+def generate_batch(items: List[dict], generate: Callable[[str, dict], dict],
+                   key: Callable[[str, dict], str],
+                   max_workers: int = DALLE_CONCURRENCY) -> Iterator[dict]:
+    '''
+    Параллельная генерация по списку {'prompt', 'options'}.
+
+    Результаты отдаются по мере готовности (с полем index исходной позиции).
+    Одинаковые промпты внутри пакета генерируются один раз. Элемент, для
+    которого не строится ключ (некорректные options), получает ошибку.
+    '''
+    groups = {}
+    for index, item in enumerate(items):
+        try:
+            item_key = key(item['prompt'], item['options'])
+        except Exception as e:
+            yield {'index': index, 'status': 'error', 'error': str(e)}
+            continue
+        groups.setdefault(item_key, []).append(index)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Копия контекста переносит трассировку запроса в рабочие потоки
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, generate,
+                items[indexes[0]]['prompt'], items[indexes[0]]['options']
+            ): indexes
+            for indexes in groups.values()
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'status': 'error', 'error': str(e)}
+            for index in futures[future]:
+                yield {'index': index, **result}
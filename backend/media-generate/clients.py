@@ -0,0 +1,34 @@
+import os
+import threading
+
+# Пул соединений на хост: пакеты DALL-E, трекер видео и загрузки идут параллельно
+HTTP_POOL_SIZE = max(int(os.environ.get('HTTP_POOL_SIZE', '16')), 1)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    '''
+    Общая для процесса HTTP-сессия с keep-alive.
+
+    requests импортируется при первом обращении, поэтому холодный старт
+    и запросы статуса видео из реестра его не загружают.
+    '''
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = create_http_session()
+    return _http_session
+
+
+def create_http_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -0,0 +1,161 @@
+import io
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+# Pillow импортируется только при рендеринге: запросы статуса видео его не грузят
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+# Именованные размеры для витрины и соцсетей
+PRESETS = {
+    'og': (1200, 630),
+    'card': (800, 800),
+    'thumb': (300, 300),
+    'banner': (1920, 1080),
+    'story': (1080, 1920),
+    'square': (1024, 1024)
+}
+
+# Размеры, которые умеет DALL-E 3
+DALLE_SIZES = {
+    '1024x1024': (1024, 1024),
+    '1792x1024': (1792, 1024),
+    '1024x1792': (1024, 1792)
+}
+
+FORMATS = {
+    'webp': ('webp', 'image/webp', 'WEBP'),
+    'avif': ('avif', 'image/avif', 'AVIF'),
+    'jpeg': ('jpg', 'image/jpeg', 'JPEG'),
+    'png': ('png', 'image/png', 'PNG')
+}
+
+DEFAULT_FORMATS = ['webp', 'jpeg']
+DEFAULT_QUALITY = 82
+UPLOAD_CONCURRENCY = 8
+# Границы запроса: сторона производной и число файлов (размеры × форматы)
+MAX_DIMENSION = 4096
+MAX_DERIVATIVES = 24
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    '''Принимает имя пресета ("og") или "ШИРИНАxВЫСОТА"; ValueError, если сторона вне 1..MAX_DIMENSION'''
+    if size in PRESETS:
+        return PRESETS[size]
+    width, height = (int(side) for side in size.lower().split('x'))
+    if not (1 <= width <= MAX_DIMENSION and 1 <= height <= MAX_DIMENSION):
+        raise ValueError(f'Size {size} is out of range 1..{MAX_DIMENSION}')
+    return width, height
+
+
+def check_derivatives(sizes: List[str], formats: List[str], quality=DEFAULT_QUALITY) -> None:
+    '''ValueError, если размер, список форматов или качество 1..100 некорректны или файлов больше MAX_DERIVATIVES'''
+    if not isinstance(formats, list) or not all(isinstance(name, str) for name in formats):
+        raise ValueError('formats must be a list of format names')
+    try:
+        valid_quality = not isinstance(quality, bool) and 1 <= int(quality) <= 100
+    except (TypeError, ValueError):
+        valid_quality = False
+    if not valid_quality:
+        raise ValueError(f'Invalid image_quality: {quality!r} (expected 1..100)')
+    for size in sizes:
+        try:
+            parse_size(size)
+        except ValueError as e:
+            raise ValueError(f'Invalid size: {size}') from e
+    requested = {str(name).lower().replace('jpg', 'jpeg') for name in formats} & set(FORMATS)
+    if len(sizes) * max(len(requested), 1) > MAX_DERIVATIVES:
+        raise ValueError(f'Too many derivatives (max {MAX_DERIVATIVES} sizes × formats)')
+
+
+def choose_dalle_size(targets: List[Tuple[int, int]]) -> str:
+    '''Один размер генерации, при котором кадрирование всех производных теряет меньше всего площади'''
+    def cropped_share(source: Tuple[int, int], target: Tuple[int, int]) -> float:
+        source_ratio = source[0] / source[1]
+        target_ratio = target[0] / target[1]
+        return 1 - min(source_ratio, target_ratio) / max(source_ratio, target_ratio)
+
+    return min(
+        DALLE_SIZES,
+        key=lambda name: sum(cropped_share(DALLE_SIZES[name], target) for target in targets)
+    )
+
+
+def supported_formats(formats: List[str]) -> List[str]:
+    from PIL import features
+
+    result = []
+    for name in formats:
+        name = name.lower().replace('jpg', 'jpeg')
+        if name not in FORMATS or name in result:
+            continue
+        if name in ('webp', 'avif') and not features.check(name):
+            continue
+        result.append(name)
+    return result or ['jpeg']
+
+
+def encode(image: 'Image.Image', format_name: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    pil_format = FORMATS[format_name][2]
+
+    if format_name == 'jpeg':
+        image.convert('RGB').save(buffer, pil_format, quality=quality, optimize=True, progressive=True)
+    elif format_name == 'webp':
+        image.save(buffer, pil_format, quality=quality, method=4)
+    elif format_name == 'avif':
+        image.save(buffer, pil_format, quality=quality)
+    else:
+        image.save(buffer, pil_format, optimize=True)
+
+    return buffer.getvalue()
+
+
+def render_derivatives(source: bytes, sizes: List[str], formats: List[str],
+                       quality: int = DEFAULT_QUALITY) -> List[dict]:
+    '''Кадрирует исходник под каждый размер (по центру), масштабирует и кодирует в нужные форматы'''
+    from PIL import Image, ImageOps
+
+    master = Image.open(io.BytesIO(source))
+    master.load()
+    if master.mode not in ('RGB', 'RGBA'):
+        master = master.convert('RGB')
+
+    rendered = []
+    for size in sizes:
+        width, height = parse_size(size)
+        image = ImageOps.fit(master, (width, height), Image.LANCZOS, centering=(0.5, 0.5))
+        for format_name in formats:
+            rendered.append({
+                'size': size,
+                'format': format_name,
+                'width': width,
+                'height': height,
+                'data': encode(image, format_name, quality)
+            })
+    return rendered
+
+
+def upload_derivatives(rendered: List[dict], store) -> Dict[str, Dict[str, dict]]:
+    '''
+    Загружает все производные одним проходом (параллельно).
+
+    store(data, extension, content_type) -> url
+    Результат: {size: {format: {url, width, height, bytes}}}
+    '''
+    def upload(item: dict) -> str:
+        extension, content_type, _ = FORMATS[item['format']]
+        return store(item['data'], extension, content_type)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+        urls = list(executor.map(upload, rendered))
+
+    derivatives = {}
+    for item, url in zip(rendered, urls):
+        derivatives.setdefault(item['size'], {})[item['format']] = {
+            'url': url,
+            'width': item['width'],
+            'height': item['height'],
+            'bytes': len(item['data'])
+        }
+    return derivatives
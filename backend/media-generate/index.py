@@ -2,14 +2,41 @@ import json
 import os
 import base64
 import time
+import hashlib
 from datetime import datetime
+from storage import get_s3_client, store_content_addressed, cdn_url, DOWNLOAD_CHUNK_SIZE
+from state import (
+    lookup_media, remember_media, get_cached_generation, cache_generation,
+    register_video_task, get_video_task, PENDING_VIDEO_STATUSES
+)
+from batch import dalle_limiter, generate_batch, MAX_BATCH_SIZE
+from video_tracker import VideoTracker, next_check_delay, MAX_LONG_POLL
+from tracing import span, traced, traced_handler
+from clients import get_http_session
+from derivatives import (
+    PILLOW_AVAILABLE, DEFAULT_FORMATS, DEFAULT_QUALITY,
+    parse_size, check_derivatives, choose_dalle_size, supported_formats, render_derivatives, upload_derivatives
+)
 
+# Один трекер на процесс; upload_to_s3 определен ниже и разрешается в момент вызова
+video_tracker = VideoTracker(
+    upload=lambda video_url, task_id: upload_to_s3(video_url, 'video', f'task:{task_id}', strict=True)
+)
+
+
+def shutdown() -> None:
+    '''Остановка процесса (backend/server.py): фоновый опрос Runway завершает текущие проверки'''
+    video_tracker.stop(timeout=10)
+
+
+@traced_handler
 def handler(event: dict, context) -> dict:
     """
     Генерация изображений и видео для SEO-оптимизации
     
     Поддерживает:
     - Изображения через DALL-E 3 (OpenAI)
+    - Пакетную генерацию изображений (type: image_batch, ответ в NDJSON)
     - Видео через Runway ML Gen-3 API
     """
     
@@ -19,7 +46,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Debug-Timing'
             },
             'body': ''
         }
@@ -28,7 +55,7 @@ def handler(event: dict, context) -> dict:
     
     # GET запрос для проверки статуса видео
     if method == 'GET':
-        params = event.get('queryStringParameters', {})
+        params = event.get('queryStringParameters') or {}
         task_id = params.get('task_id')
         
         if not task_id:
@@ -38,7 +65,18 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': 'task_id parameter required'})
             }
         
-        result = check_video_status(task_id)
+        try:
+            wait = min(max(float(params.get('wait', 0)), 0), MAX_LONG_POLL)
+        except ValueError:
+            wait = 0
+        
+        result = check_video_status(task_id, wait)
+        if result is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Video task not found'})
+            }
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -52,6 +90,9 @@ def handler(event: dict, context) -> dict:
         prompt = body.get('prompt', '')
         options = body.get('options', {})
         
+        if media_type == 'image_batch':
+            return handle_image_batch(body.get('prompts', []), options, body.get('stream', True))
+        
         if not prompt:
             return {
                 'statusCode': 400,
@@ -60,6 +101,15 @@ def handler(event: dict, context) -> dict:
             }
         
         if media_type == 'image':
+            try:
+                check_derivatives(requested_sizes(options), options.get('formats') or DEFAULT_FORMATS,
+                                  options.get('image_quality', DEFAULT_QUALITY))
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
             result = generate_image(prompt, options)
         elif media_type == 'video':
             result = generate_video(prompt, options)
@@ -84,9 +134,107 @@ def handler(event: dict, context) -> dict:
         }
 
 
+def handle_image_batch(prompts: list, options: dict, stream: bool) -> dict:
+    """Пакетная генерация: элементы — строки или {prompt, options}; общие options задают значения по умолчанию"""
+    items = []
+    positions = []
+    invalid = []
+    for position, entry in enumerate(prompts):
+        if isinstance(entry, str):
+            entry = {'prompt': entry}
+        if (not isinstance(entry, dict) or not isinstance(entry.get('prompt'), str)
+                or not entry['prompt'].strip() or not isinstance(entry.get('options', {}), dict)):
+            # Некорректный элемент получает ошибку на своей позиции, остальные генерируются
+            invalid.append({'index': position, 'status': 'error',
+                            'error': 'prompt must be a non-empty string, options an object'})
+            continue
+        items.append({'prompt': entry['prompt'], 'options': {**options, **entry.get('options', {})}})
+        positions.append(position)
+    
+    if not items:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'prompts list is required'})
+        }
+    
+    if len(items) > MAX_BATCH_SIZE:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Too many prompts (max {MAX_BATCH_SIZE})'})
+        }
+    
+    results = invalid + [
+        {**result, 'index': positions[result['index']]}
+        for result in generate_batch(items, generate_image, generation_cache_key)
+    ]
+    
+    # Ответ собирается после завершения всех элементов; строка NDJSON — результат одного элемента
+    if stream:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/x-ndjson', 'Access-Control-Allow-Origin': '*'},
+            'body': ''.join(json.dumps(result) + '\n' for result in results)
+        }
+    
+    ordered = sorted(results, key=lambda result: result['index'])
+    succeeded = sum(1 for result in ordered if result.get('status') == 'success')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'status': 'success' if succeeded == len(ordered) else 'partial' if succeeded else 'error',
+            'type': 'image_batch',
+            'results': ordered,
+            'cached': sum(1 for result in ordered if result.get('cached')),
+            'total': len(ordered)
+        })
+    }
+
+
+def generation_cache_key(prompt: str, options: dict) -> str:
+    """Ключ кэша: нормализованный промпт + параметры, влияющие на результат"""
+    normalized = {
+        'prompt': ' '.join(prompt.lower().split()),
+        'sizes': requested_sizes(options),
+        'formats': sorted(supported_formats(options.get('formats') or DEFAULT_FORMATS)) if PILLOW_AVAILABLE else [],
+        'image_quality': int(options.get('image_quality', DEFAULT_QUALITY)),
+        'quality': options.get('quality', 'standard'),
+        'style': options.get('style', 'vivid')
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def requested_sizes(options: dict) -> list:
+    """Список производных: options.sizes (пресеты или ШxВ) либо одиночный options.size"""
+    sizes = options.get('sizes') or [options.get('size', '1024x1024')]
+    if not isinstance(sizes, list):
+        sizes = [sizes]
+    return list(dict.fromkeys(str(size).strip().lower() for size in sizes))
+
+
 def generate_image(prompt: str, options: dict) -> dict:
-    """Генерация изображения через доступные API"""
-    import requests
+    """
+    Генерация изображения через доступные API (повторный промпт отдается из кэша).
+    
+    Для всех запрошенных размеров делается одна генерация; производные
+    (кадрирование, масштаб, WebP/AVIF/JPEG) готовятся локально и загружаются вместе.
+    """
+    sizes = requested_sizes(options)
+    try:
+        check_derivatives(sizes, options.get('formats') or DEFAULT_FORMATS,
+                          options.get('image_quality', DEFAULT_QUALITY))
+    except ValueError as e:
+        return {
+            'error': str(e),
+            'status': 'error'
+        }
+    
+    cache_key = generation_cache_key(prompt, options)
+    cached = get_cached_generation(cache_key)
+    if cached:
+        return {**cached, 'cached': True}
     
     openai_key = os.environ.get('OPENAI_API_KEY')
     
@@ -96,7 +244,7 @@ def generate_image(prompt: str, options: dict) -> dict:
             'status': 'error'
         }
     
-    size = options.get('size', '1024x1024')
+    size = sizes[0]
     quality = options.get('quality', 'standard')
     style = options.get('style', 'vivid')
     
@@ -107,27 +255,33 @@ def generate_image(prompt: str, options: dict) -> dict:
         '1200x630': '1792x1024'
     }
     
-    dalle_size = size_map.get(size, '1024x1024')
+    if PILLOW_AVAILABLE:
+        dalle_size = choose_dalle_size([parse_size(item) for item in sizes])
+    else:
+        dalle_size = size_map.get(size, '1024x1024')
     
     enhanced_prompt = f"{prompt}. Professional product photography, high quality, SEO optimized."
     
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/images/generations',
-            headers={
-                'Authorization': f'Bearer {openai_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'dall-e-3',
-                'prompt': enhanced_prompt,
-                'n': 1,
-                'size': dalle_size,
-                'quality': quality,
-                'style': style
-            },
-            timeout=60
-        )
+        with span('rate_limit'):
+            dalle_limiter.acquire()
+        with span('dalle'):
+            response = get_http_session().post(
+                'https://api.openai.com/v1/images/generations',
+                headers={
+                    'Authorization': f'Bearer {openai_key}',
+                    'Content-Type': 'application/json'
+                },
+                json={
+                    'model': 'dall-e-3',
+                    'prompt': enhanced_prompt,
+                    'n': 1,
+                    'size': dalle_size,
+                    'quality': quality,
+                    'style': style
+                },
+                timeout=60
+            )
         
         if response.status_code != 200:
             return {
@@ -138,17 +292,39 @@ def generate_image(prompt: str, options: dict) -> dict:
         data = response.json()
         image_url = data['data'][0]['url']
         
-        s3_url = upload_to_s3(image_url, 'image', prompt)
+        derivatives = None
+        if PILLOW_AVAILABLE:
+            try:
+                derivatives = store_image_derivatives(image_url, sizes, options)
+            except Exception as e:
+                print(f"Derivative processing error: {str(e)}")
         
-        return {
+        if derivatives:
+            first = derivatives[size]
+            s3_url = next(iter(first.values()))['url']
+        else:
+            s3_url = upload_to_s3(image_url, 'image')
+        
+        result = {
             'status': 'success',
             'type': 'image',
             'url': s3_url,
             'original_url': image_url,
             'prompt': enhanced_prompt,
             'size': size,
+            'generated_size': dalle_size,
             'generated_at': datetime.utcnow().isoformat()
         }
+        if derivatives:
+            result['derivatives'] = derivatives
+        
+        # Ссылки DALL-E временные — кэшируем только то, что сохранено в нашем хранилище;
+        # одиночный PNG вместо запрошенных производных тоже не кэшируется, иначе повторный
+        # запрос с теми же sizes/formats навсегда остался бы без derivatives
+        if s3_url != image_url and (derivatives or not PILLOW_AVAILABLE):
+            cache_generation(cache_key, result)
+        
+        return result
         
     except Exception as e:
         return {
@@ -157,10 +333,31 @@ def generate_image(prompt: str, options: dict) -> dict:
         }
 
 
+def store_image_derivatives(image_url: str, sizes: list, options: dict) -> dict:
+    """Скачивает исходник DALL-E один раз и сохраняет все производные в S3"""
+    with span('download'):
+        response = get_http_session().get(image_url, timeout=60)
+        response.raise_for_status()
+    
+    formats = supported_formats(options.get('formats') or DEFAULT_FORMATS)
+    with span('render'):
+        rendered = render_derivatives(
+            response.content, sizes, formats,
+            int(options.get('image_quality', DEFAULT_QUALITY))
+        )
+    
+    s3 = get_s3_client()
+    with span('upload'):
+        return upload_derivatives(
+            rendered,
+            lambda data, extension, content_type: cdn_url(
+                store_content_addressed(s3, [data], 'image', extension, content_type)
+            )
+        )
+
+
 def generate_video(prompt: str, options: dict) -> dict:
     """Генерация видео через Runway ML Gen-3 API"""
-    import requests
-    
     runway_key = os.environ.get('RUNWAY_API_KEY')
     
     if not runway_key:
@@ -183,21 +380,22 @@ def generate_video(prompt: str, options: dict) -> dict:
     
     try:
         # Шаг 1: Запуск генерации видео
-        response = requests.post(
-            'https://api.runwayml.com/v1/gen3/generations',
-            headers={
-                'Authorization': f'Bearer {runway_key}',
-                'Content-Type': 'application/json',
-                'X-Runway-Version': '2024-11-06'
-            },
-            json={
-                'prompt': enhanced_prompt,
-                'duration': duration,
-                'ratio': '16:9' if video_type == 'video' else '9:16',
-                'seed': int(time.time()) % 1000000
-            },
-            timeout=30
-        )
+        with span('runway'):
+            response = get_http_session().post(
+                'https://api.runwayml.com/v1/gen3/generations',
+                headers={
+                    'Authorization': f'Bearer {runway_key}',
+                    'Content-Type': 'application/json',
+                    'X-Runway-Version': '2024-11-06'
+                },
+                json={
+                    'prompt': enhanced_prompt,
+                    'duration': duration,
+                    'ratio': '16:9' if video_type == 'video' else '9:16',
+                    'seed': int(time.time()) % 1000000
+                },
+                timeout=30
+            )
         
         if response.status_code != 201:
             return {
@@ -208,6 +406,11 @@ def generate_video(prompt: str, options: dict) -> dict:
         data = response.json()
         task_id = data.get('id')
         
+        # Дальше статус отслеживает фоновый трекер, первая проверка — через обычный интервал
+        register_video_task(task_id, enhanced_prompt, time.time() + next_check_delay(0, 0))
+        video_tracker.ensure_started()
+        video_tracker.notify()
+        
         # Runway возвращает task_id, видео генерируется асинхронно
         # Реальное видео будет готово через 1-3 минуты
         
@@ -230,105 +433,85 @@ def generate_video(prompt: str, options: dict) -> dict:
         }
 
 
-def check_video_status(task_id: str) -> dict:
-    """Проверка статуса генерации видео в Runway ML"""
-    import requests
-    
-    runway_key = os.environ.get('RUNWAY_API_KEY')
+def check_video_status(task_id: str, wait: float = 0) -> dict:
+    """
+    Статус генерации видео из реестра задач (None — задача неизвестна Runway).
     
-    if not runway_key:
-        return {
-            'error': 'RUNWAY_API_KEY not configured',
-            'status': 'error'
-        }
+    Runway опрашивает фоновый VideoTracker; здесь внешних вызовов нет.
+    wait > 0 включает long-poll: ответ придет при завершении задачи или по таймауту.
+    """
+    task = get_video_task(task_id)
     
-    try:
-        response = requests.get(
-            f'https://api.runwayml.com/v1/tasks/{task_id}',
-            headers={
-                'Authorization': f'Bearer {runway_key}',
-                'X-Runway-Version': '2024-11-06'
-            },
-            timeout=30
-        )
-        
-        if response.status_code != 200:
+    if task is None:
+        # Задача создана в другом экземпляре функции — берем ее на отслеживание,
+        # если Runway ее подтвердил; неизвестные ID в реестр не попадают
+        try:
+            task = video_tracker.adopt(task_id)
+        except Exception as e:
             return {
-                'error': f'Failed to check status: {response.text}',
-                'status': 'error'
-            }
-        
-        data = response.json()
-        task_status = data.get('status')
-        
-        # Статусы: PENDING, RUNNING, SUCCEEDED, FAILED, CANCELLED
-        if task_status == 'SUCCEEDED':
-            video_url = data.get('output', [None])[0]
-            
-            if video_url:
-                # Загружаем готовое видео в S3
-                s3_url = upload_to_s3(video_url, 'video', data.get('prompt', 'video'))
-                
-                return {
-                    'status': 'completed',
-                    'type': 'video',
-                    'url': s3_url,
-                    'original_url': video_url,
-                    'task_id': task_id
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'error': 'Video URL not found in response'
-                }
-        
-        elif task_status in ['PENDING', 'RUNNING']:
-            progress = data.get('progress', 0)
-            return {
-                'status': 'processing',
-                'progress': progress,
-                'task_id': task_id,
-                'message': f'Генерация в процессе: {progress}%'
-            }
-        
-        elif task_status == 'FAILED':
-            return {
-                'status': 'failed',
-                'error': data.get('failure_reason', 'Unknown error'),
-                'task_id': task_id
-            }
-        
-        else:
-            return {
-                'status': task_status.lower(),
+                'status': 'error',
+                'error': str(e),
                 'task_id': task_id
             }
+        if task is None:
+            return None
     
-    except Exception as e:
+    video_tracker.ensure_started()
+    
+    if wait > 0 and task['status'] in PENDING_VIDEO_STATUSES:
+        video_tracker.notify()
+        with span('long_poll'):
+            task = video_tracker.wait(task_id, wait)
+    
+    if task['status'] == 'completed':
         return {
-            'error': f'Status check failed: {str(e)}',
-            'status': 'error'
+            'status': 'completed',
+            'type': 'video',
+            'url': task['url'],
+            'original_url': task['original_url'],
+            'task_id': task_id
         }
+    
+    if task['status'] in PENDING_VIDEO_STATUSES:
+        progress = task['progress']
+        result = {
+            'status': 'processing',
+            'progress': progress,
+            'task_id': task_id,
+            'message': f'Генерация в процессе: {progress}%'
+        }
+        if task['error']:
+            result['last_error'] = task['error']
+        return result
+    
+    if task['status'] in ('failed', 'error'):
+        return {
+            'status': task['status'],
+            'error': task['error'] or 'Unknown error',
+            'task_id': task_id
+        }
+    
+    return {
+        'status': task['status'],
+        'task_id': task_id
+    }
 
 
-def upload_to_s3(media_url: str, media_type: str, prompt: str) -> str:
-    """Загрузка сгенерированного медиа в S3"""
-    import boto3
-    import requests
+@traced('upload')
+def upload_to_s3(media_url: str, media_type: str, source_key: str = None, strict: bool = False) -> str:
+    """
+    Потоковая загрузка сгенерированного медиа в S3 с дедупликацией по содержимому.
+    
+    source_key (URL источника или task_id) запоминается в локальном индексе,
+    чтобы повторные запросы возвращали сохраненный URL без повторного скачивания.
+    При ошибке возвращается исходный URL, а со strict=True ошибка пробрасывается.
+    """
+    source_key = source_key or f'url:{media_url}'
+    known = lookup_media(source_key)
+    if known:
+        return known['url']
     
     try:
-        response = requests.get(media_url, timeout=60)
-        media_data = response.content
-        
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-        )
-        
-        timestamp = int(time.time())
-        safe_prompt = ''.join(c if c.isalnum() else '_' for c in prompt[:30])
-        
         # Определяем расширение и Content-Type
         if media_type == 'image':
             extension = 'png'
@@ -337,18 +520,21 @@ def upload_to_s3(media_url: str, media_type: str, prompt: str) -> str:
             extension = 'mp4'
             content_type = 'video/mp4'
         
-        file_key = f'seo-media/{media_type}_{safe_prompt}_{timestamp}.{extension}'
+        with get_http_session().get(media_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            file_key = store_content_addressed(
+                get_s3_client(),
+                response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+                media_type,
+                extension,
+                content_type
+            )
         
-        s3.put_object(
-            Bucket='files',
-            Key=file_key,
-            Body=media_data,
-            ContentType=content_type
-        )
+        url = cdn_url(file_key)
+        remember_media(source_key, url, media_url)
+        return url
         
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
-        
-        return cdn_url
-        
-    except Exception as e:
-        return media_url
\ No newline at end of file
+    except Exception:
+        if strict:
+            raise
+        return media_url
@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+
+STATE_DB_PATH = os.environ.get(
+    'MEDIA_STATE_DB',
+    os.path.join(tempfile.gettempdir(), 'media-generate.sqlite3')
+)
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_index (
+    source TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    original_url TEXT,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS generation_cache (
+    cache_key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS video_tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    prompt TEXT,
+    url TEXT,
+    original_url TEXT,
+    error TEXT,
+    checks INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_check_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS video_tasks_due ON video_tasks (status, next_check_at);
+'''
+
+
+def get_connection() -> sqlite3.Connection:
+    '''Одно соединение на процесс: переживает вызовы в "теплом" контейнере'''
+    global _connection
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                connection = sqlite3.connect(STATE_DB_PATH, check_same_thread=False, isolation_level=None)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.executescript(SCHEMA)
+                _connection = connection
+    return _connection
+
+
+def execute(sql: str, params: tuple = ()) -> list:
+    connection = get_connection()
+    with _lock:
+        return connection.execute(sql, params).fetchall()
+
+
+def lookup_media(source: str) -> Optional[dict]:
+    '''Ищет уже сохраненный файл по URL источника или task_id'''
+    rows = execute('SELECT url, original_url FROM media_index WHERE source = ?', (source,))
+    if not rows:
+        return None
+    url, original_url = rows[0]
+    return {'url': url, 'original_url': original_url}
+
+
+def remember_media(source: str, url: str, original_url: Optional[str] = None) -> None:
+    execute(
+        'INSERT OR REPLACE INTO media_index (source, url, original_url, created_at) VALUES (?, ?, ?, ?)',
+        (source, url, original_url, time.time())
+    )
+
+
+def get_cached_generation(cache_key: str) -> Optional[dict]:
+    rows = execute('SELECT result FROM generation_cache WHERE cache_key = ?', (cache_key,))
+    return json.loads(rows[0][0]) if rows else None
+
+
+def cache_generation(cache_key: str, result: dict) -> None:
+    execute(
+        'INSERT OR REPLACE INTO generation_cache (cache_key, result, created_at) VALUES (?, ?, ?)',
+        (cache_key, json.dumps(result, ensure_ascii=False), time.time())
+    )
+
+
+VIDEO_TASK_FIELDS = ('task_id', 'status', 'progress', 'prompt', 'url', 'original_url', 'error', 'checks',
+                     'created_at', 'updated_at', 'next_check_at')
+
+# Задачи в этих статусах еще ждут ответа Runway
+PENDING_VIDEO_STATUSES = ('pending', 'running', 'throttled')
+
+
+def register_video_task(task_id: str, prompt: Optional[str] = None, next_check_at: Optional[float] = None) -> None:
+    now = time.time()
+    execute(
+        'INSERT OR IGNORE INTO video_tasks (task_id, status, prompt, created_at, updated_at, next_check_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (task_id, 'pending', prompt, now, now, next_check_at if next_check_at is not None else now)
+    )
+
+
+def get_video_task(task_id: str) -> Optional[dict]:
+    rows = execute(f'SELECT {", ".join(VIDEO_TASK_FIELDS)} FROM video_tasks WHERE task_id = ?', (task_id,))
+    return dict(zip(VIDEO_TASK_FIELDS, rows[0])) if rows else None
+
+
+def due_video_tasks(now: float, limit: int = 100) -> list:
+    rows = execute(
+        f'SELECT {", ".join(VIDEO_TASK_FIELDS)} FROM video_tasks '
+        f'WHERE status IN ({", ".join("?" for _ in PENDING_VIDEO_STATUSES)}) AND next_check_at <= ? '
+        'ORDER BY next_check_at LIMIT ?',
+        (*PENDING_VIDEO_STATUSES, now, limit)
+    )
+    return [dict(zip(VIDEO_TASK_FIELDS, row)) for row in rows]
+
+
+def next_video_check_at() -> Optional[float]:
+    rows = execute(
+        f'SELECT MIN(next_check_at) FROM video_tasks '
+        f'WHERE status IN ({", ".join("?" for _ in PENDING_VIDEO_STATUSES)})',
+        PENDING_VIDEO_STATUSES
+    )
+    return rows[0][0] if rows else None
+
+
+def update_video_task(task_id: str, **fields) -> None:
+    fields['updated_at'] = time.time()
+    assignments = ', '.join(f'{name} = ?' for name in fields if name in VIDEO_TASK_FIELDS)
+    values = tuple(value for name, value in fields.items() if name in VIDEO_TASK_FIELDS)
+    execute(f'UPDATE video_tasks SET {assignments} WHERE task_id = ?', (*values, task_id))
@@ -0,0 +1,211 @@
+import os
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+
+# S3 требует минимум 5 МБ на часть (кроме последней)
+PART_SIZE = max(int(os.environ.get('S3_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+PARTS_IN_FLIGHT = max(int(os.environ.get('S3_PARTS_IN_FLIGHT', '4')), 1)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+MEDIA_PREFIX = 'seo-media'
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    '''Общий для процесса S3-клиент: создание boto3-клиента дорогое, а сам клиент потокобезопасен'''
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = create_s3_client()
+    return _s3_client
+
+
+def create_s3_client():
+    '''Создает S3-клиент; S3_ENDPOINT_URL позволяет подменить хранилище локальной заглушкой'''
+    import boto3
+
+    return boto3.client('s3',
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    )
+
+
+def cdn_url(file_key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+
+
+def iter_parts(chunks: Iterable[bytes], part_size: int = PART_SIZE) -> Iterator[bytes]:
+    '''Собирает поток чанков произвольного размера в части фиксированного размера'''
+    buffer = bytearray()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def stream_upload(s3, chunks: Iterable[bytes], file_key: str, content_type: str,
+                  bucket: str = S3_BUCKET, part_size: int = PART_SIZE,
+                  parts_in_flight: int = PARTS_IN_FLIGHT) -> None:
+    '''
+    Потоковая загрузка в S3 через multipart upload.
+
+    Части отправляются параллельно, пока продолжается скачивание следующих.
+    В памяти одновременно держится не более parts_in_flight + 1 частей,
+    поэтому расход памяти не зависит от размера файла.
+    Файл меньше одной части загружается обычным put_object.
+    '''
+    parts = iter_parts(chunks, part_size)
+    first_part = next(parts, b'')
+    second_part = next(parts, None)
+
+    if second_part is None:
+        s3.put_object(Bucket=bucket, Key=file_key, Body=first_part, ContentType=content_type)
+        return
+
+    head = [first_part, second_part]
+    first_part = second_part = None
+    multipart_upload(s3, head, parts, file_key, content_type, bucket, parts_in_flight)
+
+
+def multipart_upload(s3, head: list, parts: Iterator[bytes], file_key: str, content_type: str,
+                     bucket: str = S3_BUCKET, parts_in_flight: int = PARTS_IN_FLIGHT,
+                     finalize: Optional[Callable[[], bool]] = None) -> bool:
+    '''
+    Загружает части (сначала уже прочитанные head, затем остаток parts).
+
+    finalize вызывается после отправки всех частей; если он вернул False,
+    загрузка отменяется вместо завершения. Возвращает True, если объект создан.
+    '''
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket, Key=file_key, ContentType=content_type
+    )['UploadId']
+
+    # Отдаем уже прочитанные части без лишних ссылок на них, чтобы не удерживать память
+    def all_parts() -> Iterator[bytes]:
+        while head:
+            yield head.pop(0)
+        yield from parts
+
+    slots = threading.BoundedSemaphore(parts_in_flight)
+    failed = threading.Event()
+
+    def upload_part(part_number: int, data: bytes) -> dict:
+        try:
+            response = s3.upload_part(
+                Bucket=bucket, Key=file_key, UploadId=upload_id,
+                PartNumber=part_number, Body=data
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=parts_in_flight) as executor:
+            for part_number, data in enumerate(all_parts(), start=1):
+                slots.acquire()
+                # Прерываем скачивание сразу, если одна из частей не загрузилась
+                if failed.is_set():
+                    break
+                futures.append(executor.submit(upload_part, part_number, data))
+
+        uploaded_parts = [future.result() for future in futures]
+
+        if finalize is not None and not finalize():
+            s3.abort_multipart_upload(Bucket=bucket, Key=file_key, UploadId=upload_id)
+            return False
+
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=file_key, UploadId=upload_id,
+            MultipartUpload={'Parts': uploaded_parts}
+        )
+        return True
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=file_key, UploadId=upload_id)
+        raise
+
+
+def content_key(digest: str, media_type: str, extension: str) -> str:
+    return f'{MEDIA_PREFIX}/{media_type}/{digest[:2]}/{digest}.{extension}'
+
+
+def object_exists(s3, file_key: str, bucket: str = S3_BUCKET) -> bool:
+    from botocore.exceptions import ClientError
+
+    try:
+        s3.head_object(Bucket=bucket, Key=file_key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def store_content_addressed(s3, chunks: Iterable[bytes], media_type: str, extension: str,
+                            content_type: str, bucket: str = S3_BUCKET,
+                            part_size: int = PART_SIZE,
+                            parts_in_flight: int = PARTS_IN_FLIGHT,
+                            exists: Callable = object_exists) -> str:
+    '''
+    Сохраняет файл под ключом из SHA-256 содержимого и возвращает этот ключ.
+
+    Одинаковое содержимое хранится один раз: перед записью проверяется
+    наличие объекта. Хеш большого файла известен только после скачивания,
+    поэтому части грузятся во временный ключ, а перед завершением загрузки
+    проверяется существование итогового ключа: дубликат отменяется
+    без записи, новый файл копируется на стороне S3.
+    '''
+    hasher = hashlib.sha256()
+
+    def hashed_chunks() -> Iterator[bytes]:
+        for chunk in chunks:
+            hasher.update(chunk)
+            yield chunk
+
+    parts = iter_parts(hashed_chunks(), part_size)
+    first_part = next(parts, b'')
+    second_part = next(parts, None)
+
+    if second_part is None:
+        file_key = content_key(hasher.hexdigest(), media_type, extension)
+        if not exists(s3, file_key, bucket):
+            s3.put_object(Bucket=bucket, Key=file_key, Body=first_part, ContentType=content_type)
+        return file_key
+
+    staging_key = f'{MEDIA_PREFIX}/.staging/{uuid.uuid4().hex}.{extension}'
+    result = {}
+
+    def finalize() -> bool:
+        result['key'] = content_key(hasher.hexdigest(), media_type, extension)
+        return not exists(s3, result['key'], bucket)
+
+    head = [first_part, second_part]
+    first_part = second_part = None
+    created = multipart_upload(s3, head, parts, staging_key, content_type, bucket, parts_in_flight, finalize)
+
+    if created:
+        s3.copy_object(
+            Bucket=bucket, Key=result['key'],
+            CopySource={'Bucket': bucket, 'Key': staging_key},
+            ContentType=content_type, MetadataDirective='REPLACE'
+        )
+        s3.delete_object(Bucket=bucket, Key=staging_key)
+
+    return result['key']
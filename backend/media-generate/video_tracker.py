@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from clients import get_http_session
+from state import (
+    get_video_task, register_video_task, due_video_tasks, next_video_check_at, update_video_task,
+    PENDING_VIDEO_STATUSES
+)
+
+RUNWAY_API_URL = 'https://api.runwayml.com/v1'
+RUNWAY_API_VERSION = '2024-11-06'
+
+TRACKER_CONCURRENCY = max(int(os.environ.get('VIDEO_TRACKER_CONCURRENCY', '8')), 1)
+MIN_CHECK_DELAY = 3.0
+MAX_CHECK_DELAY = 60.0
+IDLE_SLEEP = 30.0
+MAX_LONG_POLL = 25.0
+# Задача, которую Runway так и не завершил, перестает опрашиваться
+MAX_TASK_AGE = float(os.environ.get('VIDEO_TASK_MAX_AGE', str(6 * 3600)))
+MAX_TASK_CHECKS = int(os.environ.get('VIDEO_TASK_MAX_CHECKS', '500'))
+# task_id подставляется в путь запроса к Runway
+TASK_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# Ответы 4xx, кроме этих, означают, что задачи в Runway нет и не будет
+TRANSIENT_CLIENT_ERRORS = (401, 403, 408, 429)
+
+
+class RunwayError(RuntimeError):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def permanent(self) -> bool:
+        return (self.status_code is not None and 400 <= self.status_code < 500
+                and self.status_code not in TRANSIENT_CLIENT_ERRORS)
+
+
+def next_check_delay(progress: float, checks: int) -> float:
+    '''
+    Интервал до следующей проверки задачи.
+
+    В начале генерации Runway почти ничего не сообщает — проверяем редко,
+    ближе к завершению — часто, чтобы отдать готовое видео без задержки.
+    Если прогресс не растет, интервал увеличивается с каждой проверкой.
+    '''
+    fraction = progress / 100 if progress > 1 else progress
+    if fraction >= 0.8:
+        base = MIN_CHECK_DELAY
+    elif fraction >= 0.3:
+        base = 8.0
+    else:
+        base = 15.0
+    backoff = 1.25 ** max(checks - 10, 0)
+    return min(base * backoff, MAX_CHECK_DELAY)
+
+
+def expired(task: dict, checks: int) -> bool:
+    return checks >= MAX_TASK_CHECKS or time.time() - task['created_at'] > MAX_TASK_AGE
+
+
+def fetch_runway_task(task_id: str) -> dict:
+    '''Один запрос статуса задачи в Runway ML'''
+    runway_key = os.environ.get('RUNWAY_API_KEY')
+    if not runway_key:
+        raise RunwayError('RUNWAY_API_KEY not configured')
+
+    response = get_http_session().get(
+        f'{RUNWAY_API_URL}/tasks/{task_id}',
+        headers={
+            'Authorization': f'Bearer {runway_key}',
+            'X-Runway-Version': RUNWAY_API_VERSION
+        },
+        timeout=30
+    )
+
+    if response.status_code != 200:
+        raise RunwayError(f'Failed to check status: {response.text}', response.status_code)
+
+    return response.json()
+
+
+class VideoTracker:
+    '''
+    Фоновый опрос всех незавершенных задач Runway одним циклом.
+
+    Клиенты читают статус из реестра (state.video_tasks) и не вызывают Runway сами.
+    Готовое видео загружается в S3 один раз, после чего ожидающие long-poll
+    запросы получают уведомление.
+    '''
+
+    def __init__(self, upload: Callable[[str, str], str],
+                 fetch: Callable[[str], dict] = fetch_runway_task,
+                 concurrency: int = TRACKER_CONCURRENCY):
+        self.upload = upload
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.changed = threading.Condition()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.run, name='video-tracker', daemon=True)
+                self.thread.start()
+
+    def notify(self) -> None:
+        '''Новая задача в реестре — проверить расписание без ожидания'''
+        self.wake.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='video-check') as executor:
+            while not self.stopped.is_set():
+                tasks = due_video_tasks(time.time())
+                if tasks:
+                    list(executor.map(self.check_task, tasks))
+
+                next_at = next_video_check_at()
+                sleep = IDLE_SLEEP if next_at is None else max(next_at - time.time(), 0)
+                self.wake.wait(min(sleep, IDLE_SLEEP))
+                self.wake.clear()
+
+    def check_task(self, task: dict) -> None:
+        task_id = task['task_id']
+        checks = task['checks'] + 1
+
+        try:
+            data = self.fetch(task_id)
+        except Exception as e:
+            if getattr(e, 'permanent', False) or expired(task, checks):
+                update_video_task(task_id, status='error', checks=checks, error=str(e))
+                self.publish()
+                return
+            update_video_task(
+                task_id, checks=checks,
+                error=str(e), next_check_at=time.time() + next_check_delay(0, checks + 10)
+            )
+            return
+
+        self.apply(task, checks, data)
+
+    def apply(self, task: dict, checks: int, data: dict) -> None:
+        '''Записывает в реестр ответ Runway о задаче'''
+        task_id = task['task_id']
+        # Статусы: PENDING, THROTTLED (ждет в очереди Runway), RUNNING, SUCCEEDED, FAILED, CANCELLED
+        task_status = (data.get('status') or '').upper()
+
+        if task_status in ('PENDING', 'THROTTLED', 'RUNNING'):
+            progress = data.get('progress') or 0
+            if expired(task, checks):
+                update_video_task(task_id, status='error', progress=progress, checks=checks,
+                                  error=f'Task did not finish after {checks} checks')
+            else:
+                update_video_task(
+                    task_id, status=task_status.lower(), progress=progress, checks=checks, error=None,
+                    next_check_at=time.time() + next_check_delay(progress, checks)
+                )
+                return
+        elif task_status == 'SUCCEEDED':
+            video_url = (data.get('output') or [None])[0]
+            if video_url:
+                try:
+                    url = self.upload(video_url, task_id)
+                except Exception as e:
+                    # Ссылка Runway временная: без копии в S3 задача остается в работе и проверяется снова
+                    if expired(task, checks):
+                        update_video_task(task_id, status='error', checks=checks, error=f'Upload failed: {e}')
+                        self.publish()
+                    else:
+                        update_video_task(
+                            task_id, status='running', progress=1, checks=checks, error=f'Upload failed: {e}',
+                            next_check_at=time.time() + next_check_delay(0, checks + 10)
+                        )
+                    return
+                update_video_task(
+                    task_id, status='completed', progress=1, checks=checks, error=None,
+                    url=url, original_url=video_url
+                )
+            else:
+                update_video_task(task_id, status='error', checks=checks, error='Video URL not found in response')
+        elif task_status == 'FAILED':
+            update_video_task(task_id, status='failed', checks=checks, error=data.get('failure_reason', 'Unknown error'))
+        else:
+            update_video_task(task_id, status=task_status.lower() or 'error', checks=checks)
+
+        self.publish()
+
+    def adopt(self, task_id: str) -> Optional[dict]:
+        '''
+        Задача, которой нет в реестре (создана в другом экземпляре функции):
+        попадает на отслеживание, только если Runway ее подтвердил. None —
+        некорректный task_id или Runway такой задачи не знает. Временные
+        ошибки Runway пробрасываются, задача при этом не регистрируется.
+        '''
+        if not TASK_ID_RE.match(task_id):
+            return None
+        try:
+            data = self.fetch(task_id)
+        except RunwayError as e:
+            if e.permanent:
+                return None
+            raise
+
+        register_video_task(task_id)
+        self.apply(get_video_task(task_id), 1, data)
+        return get_video_task(task_id)
+
+    def publish(self) -> None:
+        with self.changed:
+            self.changed.notify_all()
+
+    def wait(self, task_id: str, timeout: float) -> Optional[dict]:
+        '''Long-poll: ждет завершения задачи не дольше timeout и возвращает ее текущее состояние'''
+        deadline = time.monotonic() + min(timeout, MAX_LONG_POLL)
+
+        with self.changed:
+            task = get_video_task(task_id)
+            while task and task['status'] in PENDING_VIDEO_STATUSES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+                task = get_video_task(task_id)
+
+        return task
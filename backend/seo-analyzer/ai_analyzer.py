@@ -1,32 +1,38 @@
 import os
 import json
-from typing import Dict, Optional
-
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-
-def analyze_product_with_ai(html_content: str, basic_data: Dict) -> Optional[Dict]:
-    if not OPENAI_AVAILABLE:
-        return None
-    
-    api_key = os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        return None
-    
-    try:
-        client = OpenAI(api_key=api_key)
-        
-        html_snippet = html_content[:15000]
-        
-        prompt = f"""Проанализируй HTML-код страницы товара и извлеки МАКСИМУМ информации для создания лидерского SEO-контента.
+import time
+import threading
+import importlib.util
+from typing import Dict, Optional, Tuple
+from tracing import span
+import router
+
+# Сам openai импортируется только при первом AI-анализе: запросы brand/category
+# и холодный старт функции не платят за загрузку SDK
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def get_openai_client(api_key: str):
+    '''Один клиент на "теплый" контейнер: переиспользует HTTP-соединения с API'''
+    global _client, _client_key
+    with _client_lock:
+        if _client is None or _client_key != api_key:
+            from openai import OpenAI
+            _client = OpenAI(api_key=api_key)
+            _client_key = api_key
+        return _client
+
+SYSTEM_PROMPT = "Ты эксперт по SEO-копирайтингу и анализу товаров для интернет-магазинов. Твоя задача - извлечь максимум информации из HTML-кода страницы товара и структурировать её для создания лидерского контента."
+
+PRODUCT_PROMPT_TEMPLATE = """Проанализируй HTML-код страницы товара и извлеки МАКСИМУМ информации для создания лидерского SEO-контента.
 
 Базовые данные (уже извлечены):
-- Название: {basic_data.get('product_name', 'Не найдено')}
-- Бренд: {basic_data.get('brand', 'Не найдено')}
-- Цена: {basic_data.get('price', 'Не найдено')}
+- Название: {product_name}
+- Бренд: {brand}
+- Цена: {price}
 
 HTML-фрагмент страницы:
 {html_snippet}
@@ -68,23 +74,90 @@ HTML-фрагмент страницы:
 - Используй профессиональную терминологию
 - Создавай продающие формулировки"""
 
+def ai_configured() -> bool:
+    return OPENAI_AVAILABLE and bool(os.environ.get('OPENAI_API_KEY'))
+
+def complete(client, model: str, prompt: str, max_tokens: Optional[int] = None) -> Tuple[Dict, int, int]:
+    '''JSON-ответ модели и расход токенов (prompt, completion)'''
+    params = {'max_tokens': max_tokens} if max_tokens else {}
+    with span('openai'):
         response = client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=model,
             messages=[
-                {"role": "system", "content": "Ты эксперт по SEO-копирайтингу и анализу товаров для интернет-магазинов. Твоя задача - извлечь максимум информации из HTML-кода страницы товара и структурировать её для создания лидерского контента."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            **params
         )
-        
-        result = json.loads(response.choices[0].message.content)
+    usage = response.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+    return json.loads(response.choices[0].message.content), prompt_tokens, completion_tokens
+
+def deterministic_product_analysis(html_content: str, basic_data: Dict) -> Optional[Dict]:
+    '''
+    Запасной анализ без модели для карточек уровня deterministic, когда AI-анализа
+    нет (не настроен ключ или модель не ответила): поля со страницы и SEO-мета,
+    собранные из них. Для остальных карточек None. Это не AI-анализ.
+    '''
+    if router.choose_tier(router.complexity_score(basic_data, html_content)) != router.DETERMINISTIC:
+        return None
+    analysis, _ = router.deterministic_analysis(basic_data)
+    return {**analysis, 'seo_meta': router.parsed_seo_meta(basic_data, analysis)}
+
+def analyze_product_with_ai(html_content: str, basic_data: Dict) -> Optional[Dict]:
+    if not OPENAI_AVAILABLE:
+        return None
+    
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        return None
+
+    started = time.perf_counter()
+    with span('route'):
+        score = router.complexity_score(basic_data, html_content)
+        tier = router.choose_tier(score)
+        base, missing = router.deterministic_analysis(basic_data)
+        if tier == router.DETERMINISTIC:
+            # Поля со страницы уже заполнены: модель пишет только продающие тексты и SEO-мета
+            fields = [field for field in missing if field in router.COPY_FIELDS]
+        else:
+            fields = missing
+    model, prompt_tokens, completion_tokens = '', 0, 0
+    result = None
+
+    try:
+        client = get_openai_client(api_key)
+        if tier != router.FULL:
+            # Модель видит только извлеченные данные и дописывает недостающие поля
+            model = router.REDUCED_MODEL
+            answer, prompt_tokens, completion_tokens = complete(
+                client, model, router.reduced_prompt(basic_data, fields), max_tokens=router.REDUCED_MAX_TOKENS
+            )
+            result = {**base, **{field: answer[field] for field in fields if answer.get(field)}}
+        else:
+            model = router.FULL_MODEL
+            prompt = PRODUCT_PROMPT_TEMPLATE.format(
+                product_name=basic_data.get('product_name', 'Не найдено'),
+                brand=basic_data.get('brand', 'Не найдено'),
+                price=basic_data.get('price', 'Не найдено'),
+                html_snippet=html_content[:15000]
+            )
+            result, prompt_tokens, completion_tokens = complete(client, model, prompt)
         return result
     
     except Exception as e:
         print(f"AI analysis error: {str(e)}")
         return None
 
+    finally:
+        router.log_decision(router.decision(
+            tier, score, model, fields if tier != router.FULL else [],
+            started, prompt_tokens, completion_tokens, result
+        ))
+
 def format_extracted_data(ai_data: Dict, basic_data: Dict) -> str:
     if not ai_data:
         return format_basic_data(basic_data)
@@ -98,7 +171,7 @@ def format_extracted_data(ai_data: Dict, basic_data: Dict) -> str:
 🏷️ БРЕНД: {basic_data.get('brand', 'Не указан')}
 
 📝 ПОДРОБНОЕ ОПИСАНИЕ
-{ai_data.get('description', 'Описание не найдено')}
+{ai_data.get('description') or basic_data.get('description') or 'Описание не найдено'}
 
 ✨ КЛЮЧЕВЫЕ ОСОБЕННОСТИ
 """
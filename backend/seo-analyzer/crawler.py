@@ -0,0 +1,210 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.robotparser
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, NamedTuple, Optional, Union
+
+from tracing import span
+
+# Вежливость к магазинам: небольшие хосты на OpenCart банят уже за несколько
+# запросов в секунду, поэтому лимиты действуют на каждый хост отдельно,
+# а разные хосты обходятся параллельно
+HOST_CONCURRENCY = max(int(os.environ.get('CRAWL_HOST_CONCURRENCY', '2')), 1)
+# Запросов в секунду к одному хосту; 0 — без ограничения
+HOST_RPS = float(os.environ.get('CRAWL_HOST_RPS', '3'))
+RESPECT_ROBOTS = os.environ.get('CRAWL_ROBOTS', '1') != '0'
+MAX_RETRIES = max(int(os.environ.get('CRAWL_MAX_RETRIES', '2')), 0)
+MAX_HOST_DELAY = 60.0
+ROBOTS_TTL = 24 * 3600
+ROBOTS_TIMEOUT = 5
+ROBOTS_USER_AGENT = 'SEOAnalyzerBot'
+
+THROTTLE_STATUSES = (429, 503)
+# После успешного ответа замедленный хост постепенно возвращается к базовому темпу
+RECOVERY_FACTOR = 0.8
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = contextvars.ContextVar('crawl_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def crawl_priority(priority: int):
+    '''Очередь, в которой ждут загрузки внутри блока: одиночный анализ обгоняет фоновые задачи'''
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class FetchResult(NamedTuple):
+    status: int
+    headers: object
+    body: bytes
+
+
+class HostState:
+    def __init__(self, base_interval: float):
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.next_start = 0.0
+        self.active = 0
+        self.waiters = []
+        self.robots_checked_at: Optional[float] = None
+        self.robots_ready = threading.Event()
+
+
+class CrawlScheduler:
+    '''
+    Очередь загрузок по хостам: не больше HOST_CONCURRENCY одновременных
+    запросов и не чаще одного старта за interval на хост. interval растет
+    при 429/503 (с учетом Retry-After) и Crawl-delay из robots.txt.
+    '''
+
+    def __init__(self, concurrency: int = HOST_CONCURRENCY, rps: float = HOST_RPS,
+                 respect_robots: bool = RESPECT_ROBOTS):
+        self.concurrency = concurrency
+        self.default_interval = 1.0 / rps if rps > 0 else 0.0
+        self.respect_robots = respect_robots
+        self.cond = threading.Condition()
+        self.hosts: Dict[str, HostState] = {}
+        self.sequence = itertools.count()
+
+    def host(self, name: str) -> HostState:
+        state = self.hosts.get(name)
+        if state is None:
+            state = self.hosts[name] = HostState(self.default_interval)
+        return state
+
+    def prepare(self, scheme: str, name: str) -> None:
+        '''Один раз в ROBOTS_TTL читает Crawl-delay хоста'''
+        if not self.respect_robots:
+            return
+        with self.cond:
+            state = self.host(name)
+            now = time.time()
+            fresh = state.robots_checked_at is not None and now - state.robots_checked_at < ROBOTS_TTL
+            if not fresh:
+                state.robots_checked_at = now
+        if fresh:
+            # Первые запросы к хосту ждут, пока robots.txt прочитает другой поток
+            state.robots_ready.wait(ROBOTS_TIMEOUT + 1)
+            return
+
+        try:
+            delay = robots_crawl_delay(f'{scheme}://{name}/robots.txt')
+            if delay:
+                with self.cond:
+                    state.base_interval = max(self.default_interval, min(delay, MAX_HOST_DELAY))
+                    state.interval = max(state.interval, state.base_interval)
+                    self.cond.notify_all()
+        finally:
+            state.robots_ready.set()
+
+    def acquire(self, name: str, priority: int) -> None:
+        with self.cond:
+            state = self.host(name)
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(state.waiters, ticket)
+            while True:
+                if state.waiters[0] == ticket and state.active < self.concurrency:
+                    wait = state.next_start - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(state.waiters)
+                        state.active += 1
+                        state.next_start = time.monotonic() + state.interval
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+
+    def release(self, name: str, status: int, retry_after: Optional[float] = None) -> None:
+        with self.cond:
+            state = self.host(name)
+            state.active -= 1
+            if status in THROTTLE_STATUSES:
+                state.interval = min(max(state.interval * 2, state.base_interval, 0.5), MAX_HOST_DELAY)
+                delay = min(retry_after if retry_after is not None else state.interval, MAX_HOST_DELAY)
+                state.next_start = max(state.next_start, time.monotonic() + delay)
+            elif status and state.interval > state.base_interval:
+                state.interval = max(state.base_interval, state.interval * RECOVERY_FACTOR)
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, dict]:
+        with self.cond:
+            return {
+                name: {
+                    'interval': round(state.interval, 3),
+                    'active': state.active,
+                    'waiting': len(state.waiters)
+                }
+                for name, state in self.hosts.items()
+            }
+
+
+def robots_crawl_delay(robots_url: str) -> Optional[float]:
+    parser = urllib.robotparser.RobotFileParser()
+    try:
+        with urllib.request.urlopen(robots_url, timeout=ROBOTS_TIMEOUT) as response:
+            parser.parse(response.read().decode('utf-8', errors='ignore').splitlines())
+    except Exception:
+        return None
+    delay = parser.crawl_delay(ROBOTS_USER_AGENT)
+    return float(delay) if delay else None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+scheduler = CrawlScheduler()
+
+
+def fetch(request: Union[str, urllib.request.Request], timeout: int = 15) -> FetchResult:
+    '''
+    Единая точка загрузки страниц магазинов: ожидание очереди хоста,
+    запрос и повтор при 429/503 после паузы, которую назначил сервер.
+    Ошибки HTTP пробрасываются как HTTPError (429/503 — когда повторы исчерпаны).
+    '''
+    url = request.full_url if isinstance(request, urllib.request.Request) else request
+    parts = urllib.parse.urlsplit(url)
+    name = parts.netloc.lower()
+    scheduler.prepare(parts.scheme, name)
+
+    attempt = 0
+    while True:
+        with span('crawl_wait'):
+            scheduler.acquire(name, _priority.get())
+        status, retry_after = 0, None
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = response.read()
+                status = response.status
+                return FetchResult(status, response.headers, body)
+        except urllib.error.HTTPError as e:
+            status = e.code
+            retry_after = parse_retry_after(e.headers.get('Retry-After') if e.headers else None)
+            if status not in THROTTLE_STATUSES or attempt >= MAX_RETRIES:
+                raise
+        finally:
+            scheduler.release(name, status, retry_after)
+        attempt += 1
@@ -0,0 +1,346 @@
+'''
+Потоковый экспорт результатов анализа в форматы импорта OpenCart 3.
+
+Вход — результаты функции (ответы type product/category/products, по одному
+JSON на строку). Строки обрабатываются по одной и пишутся блоками, поэтому
+память не зависит от размера выгрузки; файл появляется под своим именем
+только целиком (временный файл + os.replace).
+
+    python backend/seo-analyzer/export.py results.ndjson --format sql --out seo.sql
+    python backend/seo-analyzer/export.py results.ndjson --format csv --entity category --out categories.csv
+'''
+import os
+import re
+import csv
+import sys
+import html
+import json
+import uuid
+import argparse
+import urllib.parse
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+FORMATS = ('csv', 'xml', 'sql')
+ENTITIES = ('product', 'category')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xml': 'application/xml; charset=utf-8',
+    'sql': 'application/sql; charset=utf-8'
+}
+
+DEFAULT_PREFIX = 'oc_'
+# Префикс подставляется в SQL как часть имени таблицы, поэтому допускаются
+# только символы, из которых OpenCart собирает DB_PREFIX
+PREFIX_RE = re.compile(r'^[A-Za-z0-9_]{0,32}$')
+DEFAULT_LANGUAGE_ID = 1
+CSV_DELIMITER = ';'
+# Размер блока записи и число UPDATE в одной транзакции
+CHUNK_SIZE = 1 << 20
+SQL_TRANSACTION_ROWS = 1000
+META_DESCRIPTION_LENGTH = 160
+
+COLUMNS = {
+    'product': ['product_id', 'keyword', 'language_id', 'name', 'description',
+                'meta_title', 'meta_description', 'meta_keyword', 'tag', 'url'],
+    'category': ['category_id', 'keyword', 'language_id', 'name', 'description',
+                 'meta_title', 'meta_description', 'meta_keyword', 'url']
+}
+# Колонки *_description, которые обновляет SQL-выгрузка
+SQL_FIELDS = {
+    'product': ['description', 'meta_title', 'meta_description', 'meta_keyword', 'tag'],
+    'category': ['description', 'meta_title', 'meta_description', 'meta_keyword']
+}
+
+
+class ChunkedWriter:
+    '''Копит мелкие записи и отдает их файлу блоками по CHUNK_SIZE символов'''
+
+    def __init__(self, target: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.target = target
+        self.chunk_size = chunk_size
+        self.parts: List[str] = []
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.parts:
+            self.target.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+
+
+@contextmanager
+def atomic_write(path: str):
+    '''Пишет во временный файл рядом с path и подменяет path только после успешной записи'''
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def opencart_target(url: str, entity: str) -> Dict[str, str]:
+    '''
+    Идентификатор записи из URL магазина: product_id / path категории
+    из index.php?route=..., иначе SEO-ключ (последний сегмент пути).
+    '''
+    parts = urllib.parse.urlsplit(url or '')
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    if entity == 'product' and params.get('product_id', '').isdigit():
+        return {'id': params['product_id'], 'keyword': ''}
+    if entity == 'category':
+        category_id = params.get('category_id') or params.get('path', '').split('_')[-1]
+        if category_id.isdigit():
+            return {'id': category_id, 'keyword': ''}
+    segment = parts.path.rstrip('/').rsplit('/', 1)[-1]
+    if segment.endswith('.html'):
+        segment = segment[:-len('.html')]
+    if segment and segment != 'index.php':
+        return {'id': '', 'keyword': segment}
+    return {'id': '', 'keyword': ''}
+
+
+def text_to_html(text: str) -> str:
+    '''Абзацы через пустую строку -> <p>, строки-пункты ("•", "-", "✓") -> <ul>'''
+    blocks = []
+    for block in (text or '').strip().split('\n\n'):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        items = [line for line in lines if line[:1] in ('•', '-', '✓')]
+        paragraph = [line for line in lines if line[:1] not in ('•', '-', '✓')]
+        if paragraph:
+            blocks.append(f"<p>{html.escape(' '.join(paragraph), quote=False)}</p>")
+        if items:
+            blocks.append('<ul>' + ''.join(
+                f'<li>{html.escape(item[1:].strip(), quote=False)}</li>' for item in items
+            ) + '</ul>')
+    return ''.join(blocks)
+
+
+def meta_description(text: str) -> str:
+    text = ' '.join((text or '').split())
+    if len(text) <= META_DESCRIPTION_LENGTH:
+        return text
+    return text[:META_DESCRIPTION_LENGTH - 1].rsplit(' ', 1)[0] + '…'
+
+
+def product_row(result: Dict) -> Dict[str, str]:
+    # Без AI-анализа — поля со страницы и SEO-мета уровня deterministic, если они есть
+    ai = result.get('ai_analysis') or result.get('deterministic_analysis') or {}
+    seo = ai.get('seo_meta') or {}
+    description = text_to_html(ai.get('description', ''))
+    if description and ai.get('key_features'):
+        description += '<ul>' + ''.join(
+            f'<li>{html.escape(str(feature), quote=False)}</li>' for feature in ai['key_features']
+        ) + '</ul>'
+    target = opencart_target(result.get('url', ''), 'product')
+    return {
+        'product_id': target['id'],
+        'keyword': target['keyword'],
+        'name': seo.get('h1') or ai.get('full_name') or result.get('product_name', ''),
+        'description': description,
+        'meta_title': seo.get('title', ''),
+        'meta_description': seo.get('description', ''),
+        'meta_keyword': ', '.join(seo.get('keywords') or []),
+        'tag': ', '.join(ai.get('lsi_phrases') or seo.get('keywords') or []),
+        'url': result.get('url', '')
+    }
+
+
+def category_row(result: Dict) -> Dict[str, str]:
+    analysis = result.get('analysis') or {}
+    name = result.get('category_name') or analysis.get('h1') or analysis.get('page_title', '')
+    target = opencart_target(result.get('url', ''), 'category')
+    return {
+        'category_id': target['id'],
+        'keyword': target['keyword'],
+        'name': name,
+        'description': text_to_html(result.get('description', '')),
+        'meta_title': name,
+        'meta_description': meta_description(result.get('description', '').split('\n\n')[0]),
+        'meta_keyword': ', '.join(analysis.get('keywords') or []),
+        'url': result.get('url', '')
+    }
+
+
+def export_rows(results: Iterable[Dict], language_id: int = DEFAULT_LANGUAGE_ID) -> Iterator[Dict]:
+    '''Строки выгрузки {'entity', поля...} из ответов функции; пакет products разворачивается'''
+    for result in results:
+        kind = result.get('type')
+        if kind == 'products':
+            yield from export_rows(result.get('results') or [], language_id)
+            continue
+        if result.get('status') == 'error':
+            continue
+        if kind == 'category' or (kind is None and 'analysis' in result):
+            row, entity = category_row(result), 'category'
+        else:
+            row, entity = product_row(result), 'product'
+        yield {'entity': entity, 'language_id': str(language_id), **row}
+
+
+def sql_string(value: str) -> str:
+    '''Строковый литерал MySQL'''
+    escaped = (value.replace('\\', '\\\\').replace("'", "\\'").replace('\0', '\\0')
+               .replace('\n', '\\n').replace('\r', '\\r').replace('\x1a', '\\Z'))
+    return f"'{escaped}'"
+
+
+def opencart_escape(value: str) -> str:
+    '''Так OpenCart сохраняет данные из админки: htmlspecialchars(..., ENT_COMPAT)'''
+    return html.escape(value, quote=False).replace('"', '&quot;')
+
+
+def check_prefix(prefix: str) -> str:
+    if not isinstance(prefix, str) or not PREFIX_RE.match(prefix):
+        raise ValueError(f'Invalid table prefix: {prefix!r}')
+    return prefix
+
+
+def has_content(row: Dict) -> bool:
+    '''Есть ли в строке тексты для записи: пустые поля затерли бы тексты магазина при импорте'''
+    return any(row.get(field) for field in SQL_FIELDS[row['entity']])
+
+
+def sql_update(row: Dict, prefix: str) -> Optional[str]:
+    check_prefix(prefix)
+    entity = row['entity']
+    values = {field: opencart_escape(row[field]) for field in SQL_FIELDS[entity] if row.get(field)}
+    if not values:
+        return None
+    table = f'`{prefix}{entity}_description`'
+    if row[f'{entity}_id']:
+        assignments = ', '.join(f'`{field}` = {sql_string(value)}' for field, value in values.items())
+        return (f"UPDATE {table} SET {assignments} "
+                f"WHERE `{entity}_id` = {int(row[f'{entity}_id'])} AND `language_id` = {int(row['language_id'])};\n")
+    if row['keyword']:
+        assignments = ', '.join(f'd.`{field}` = {sql_string(value)}' for field, value in values.items())
+        return (f"UPDATE {table} d JOIN `{prefix}seo_url` s "
+                f"ON s.`query` = CONCAT('{entity}_id=', d.`{entity}_id`) AND s.`language_id` = d.`language_id` "
+                f"SET {assignments} "
+                f"WHERE s.`keyword` = {sql_string(row['keyword'])} AND d.`language_id` = {int(row['language_id'])};\n")
+    return None
+
+
+def xml_text(value: str) -> str:
+    return (value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'))
+
+
+def xml_cdata(value: str) -> str:
+    return '<![CDATA[' + value.replace(']]>', ']]]]><![CDATA[>') + ']]>'
+
+
+def write_export(results: Iterable[Dict], out: TextIO, export_format: str, entity: Optional[str] = None,
+                 prefix: str = DEFAULT_PREFIX, language_id: int = DEFAULT_LANGUAGE_ID) -> Dict[str, int]:
+    '''
+    Пишет выгрузку в out по мере чтения results.
+
+    CSV содержит один тип записей (entity, по умолчанию product), XML и SQL —
+    товары и категории вместе (или только entity). Записи без текстов (описания,
+    мета-тегов, тегов) пропускаются во всех форматах, записи без идентификатора
+    и SEO-ключа — в SQL. Возвращает {'rows', 'skipped'}.
+    '''
+    if export_format not in FORMATS:
+        raise ValueError(f'Unknown export format: {export_format}')
+    check_prefix(prefix)
+    if export_format == 'csv':
+        entity = entity or 'product'
+
+    writer = ChunkedWriter(out)
+    stats = {'rows': 0, 'skipped': 0}
+
+    if export_format == 'csv':
+        csv_writer = csv.DictWriter(writer, fieldnames=COLUMNS[entity], delimiter=CSV_DELIMITER,
+                                    extrasaction='ignore', lineterminator='\r\n')
+        csv_writer.writeheader()
+    elif export_format == 'xml':
+        writer.write('<?xml version="1.0" encoding="UTF-8"?>\n<opencart>\n')
+    else:
+        writer.write('SET NAMES utf8mb4;\nSTART TRANSACTION;\n')
+
+    for row in export_rows(results, language_id):
+        if entity and row['entity'] != entity:
+            continue
+        if not has_content(row):
+            stats['skipped'] += 1
+            continue
+        if export_format == 'csv':
+            csv_writer.writerow(row)
+        elif export_format == 'xml':
+            fields = ''.join(
+                f'    <{column}>{xml_cdata(row[column]) if column == "description" else xml_text(row[column])}</{column}>\n'
+                for column in COLUMNS[row['entity']]
+            )
+            writer.write(f'  <{row["entity"]}>\n{fields}  </{row["entity"]}>\n')
+        else:
+            statement = sql_update(row, prefix)
+            if statement is None:
+                stats['skipped'] += 1
+                continue
+            writer.write(statement)
+            if (stats['rows'] + 1) % SQL_TRANSACTION_ROWS == 0:
+                writer.write('COMMIT;\nSTART TRANSACTION;\n')
+        stats['rows'] += 1
+
+    if export_format == 'xml':
+        writer.write('</opencart>\n')
+    elif export_format == 'sql':
+        writer.write('COMMIT;\n')
+    writer.flush()
+    return stats
+
+
+def export_file(results: Iterable[Dict], path: str, export_format: str, **options) -> Dict[str, int]:
+    with atomic_write(path) as f:
+        return write_export(results, f, export_format, **options)
+
+
+def read_ndjson(f: TextIO) -> Iterator[Dict]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def table_prefix(value: str) -> str:
+    try:
+        return check_prefix(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('допустимы латиница, цифры и "_", не длиннее 32 символов')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='NDJSON с ответами функции (- — stdin)')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--entity', choices=ENTITIES, help='только товары или только категории')
+    parser.add_argument('--out', required=True, help='файл выгрузки')
+    parser.add_argument('--prefix', type=table_prefix, default=DEFAULT_PREFIX, help='префикс таблиц OpenCart')
+    parser.add_argument('--language-id', type=int, default=DEFAULT_LANGUAGE_ID)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        stats = export_file(read_ndjson(source), args.out, args.format, entity=args.entity,
+                            prefix=args.prefix, language_id=args.language_id)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"{args.out}: {stats['rows']} записей, пропущено {stats['skipped']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+import hashlib
+from typing import Dict, Optional
+
+# Повторный прогон по каталогу: неизменившиеся товары не разбираются и не
+# отправляются в OpenAI, изменение только цены обновляет сохраненный результат
+INCREMENTAL = os.environ.get('SEO_INCREMENTAL', '1') != '0'
+
+NEW = 'new'
+UNCHANGED = 'unchanged'
+PRICE_ONLY = 'price_only'
+CONTENT_CHANGED = 'content_changed'
+
+CONTENT_FIELDS = ('name', 'brand', 'description_hash', 'spec_hash')
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def fingerprint(basic_data: Dict) -> Dict[str, str]:
+    '''Отпечаток извлеченных полей: текст описания и характеристик хранится только хешем'''
+    return {
+        'name': basic_data.get('product_name', ''),
+        'brand': basic_data.get('brand', ''),
+        'price': basic_data.get('price', ''),
+        'description_hash': digest(' '.join(basic_data.get('description', '').split())),
+        'spec_hash': digest('\n'.join(basic_data.get('specifications') or []))
+    }
+
+
+def classify(previous: Optional[Dict], current: Dict[str, str]) -> str:
+    if previous is None:
+        return NEW
+    if any(previous.get(field) != current[field] for field in CONTENT_FIELDS):
+        return CONTENT_CHANGED
+    if previous.get('price') != current['price']:
+        return PRICE_ONLY
+    return UNCHANGED
@@ -1,11 +1,81 @@
+import io
+import os
 import json
+import contextvars
+import urllib.error
 import urllib.parse
 import urllib.request
 import re
 from html.parser import HTMLParser
 from collections import Counter
-from typing import Dict, List, Set
-from ai_analyzer import analyze_product_with_ai, format_extracted_data
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+from ai_analyzer import analyze_product_with_ai, deterministic_product_analysis, ai_configured, format_extracted_data
+from router import route_stats
+from tracing import span, traced, traced_handler
+from variants import find_variant, remember_analysis
+from fingerprints import INCREMENTAL, UNCHANGED, PRICE_ONLY, fingerprint, classify
+from state import get_fingerprint, save_fingerprint, touch_fingerprint
+from singleflight import coalesced, flights, normalize_url, normalize_query
+from crawler import fetch, crawl_priority, scheduler, BACKGROUND, INTERACTIVE
+from export import (
+    write_export, FORMATS as EXPORT_FORMATS, ENTITIES as EXPORT_ENTITIES,
+    CONTENT_TYPES as EXPORT_CONTENT_TYPES, PREFIX_RE as EXPORT_PREFIX_RE, DEFAULT_PREFIX, DEFAULT_LANGUAGE_ID
+)
+
+# Пакетный анализ (type: products): потоков на запрос и максимум URL в пакете
+BULK_CONCURRENCY = max(int(os.environ.get('SEO_BULK_CONCURRENCY', '16')), 1)
+MAX_BULK_URLS = 50
+
+# Регулярные выражения компилируются один раз на контейнер, а не при каждом запросе
+TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+H1_RE = re.compile(r'<h1[^>]*>(.*?)</h1>', re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r'<[^>]+>')
+SPACES_RE = re.compile(r'\s+')
+PARSER_BRAND_RE = re.compile(r'\b([A-Z][a-zA-Z]+)\b')
+PRODUCT_CLASS_KEYWORDS = ('product', 'item', 'card', 'товар')
+
+CATEGORY_BRAND_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'"brand"[:\s]+"([^"]+)"',
+    r'data-brand="([^"]+)"',
+    r'"manufacturer"[:\s]+"([^"]+)"',
+    r'\b(Apple|Samsung|Xiaomi|Huawei|Sony|LG|Nokia|Realme|OPPO|Vivo|OnePlus|Google|Asus|Lenovo|Motorola|HTC|Honor|ZTE|Meizu|TCL)\b'
+)]
+CATEGORY_PRICE_RE = re.compile(r'(\d[\d\s]{3,})\s*(?:₽|руб)')
+RUSSIAN_WORD_RE = re.compile(r'\b[а-яА-ЯёЁ]{4,}\b')
+STOP_WORDS = frozenset({'этот', 'того', 'этого', 'можно', 'есть', 'быть', 'очень', 'более', 'самый', 'который', 'весь', 'товар', 'цена', 'рубль', 'купить'})
+
+PRODUCT_BRAND_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'"brand"[:\s]*"([^"]+)"',
+    r'data-brand="([^"]+)"',
+    r'"manufacturer"[:\s]*"([^"]+)"',
+    r'Бренд[:\s]*([А-ЯA-Z][а-яa-z]+)',
+    r'Производитель[:\s]*([А-ЯA-Z][а-яa-z]+)'
+)]
+PRODUCT_PRICE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'(\d[\d\s]{3,})\s*₽',
+    r'(\d[\d\s]{3,})\s*руб',
+    r'"price"[:\s]*"?(\d+)"?',
+    r'data-price="(\d+)"'
+)]
+PRODUCT_DESC_PATTERNS = [re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in (
+    r'<meta[^>]+name=["\']description["\'][^>]+content=["\']([^"\']+)',
+    r'"description"[:\s]*"([^"]+)"',
+    r'<div[^>]*class="[^"]*description[^"]*"[^>]*>(.*?)</div>'
+)]
+TABLE_RE = re.compile(r'<table[^>]*>(.*?)</table>', re.IGNORECASE | re.DOTALL)
+ROW_RE = re.compile(r'<tr[^>]*>(.*?)</tr>', re.IGNORECASE | re.DOTALL)
+CELL_RE = re.compile(r'<t[dh][^>]*>(.*?)</t[dh]>', re.IGNORECASE | re.DOTALL)
+
+BRAND_DESC_PATTERNS = [re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in (
+    r'<div[^>]*class="[^"]*brand[_-]?description[^"]*"[^>]*>(.*?)</div>',
+    r'<div[^>]*class="[^"]*about[_-]?brand[^"]*"[^>]*>(.*?)</div>',
+    r'<div[^>]*class="[^"]*description[^"]*"[^>]*>(.*?)</div>',
+    r'<section[^>]*class="[^"]*brand[^"]*"[^>]*>(.*?)</section>',
+    r'<article[^>]*>(.*?)</article>'
+)]
+PARAGRAPH_RE = re.compile(r'<p[^>]*>(.*?)</p>', re.IGNORECASE | re.DOTALL)
 
 class ProductParser(HTMLParser):
     def __init__(self):
@@ -19,7 +89,7 @@ class ProductParser(HTMLParser):
         attrs_dict = dict(attrs)
         class_name = attrs_dict.get('class', '')
         
-        if any(keyword in class_name.lower() for keyword in ['product', 'item', 'card', 'товар']):
+        if any(keyword in class_name.lower() for keyword in PRODUCT_CLASS_KEYWORDS):
             self.in_product = True
     
     def handle_data(self, data):
@@ -32,13 +102,15 @@ class ProductParser(HTMLParser):
             if len(text) > 10:
                 self.products.append(text)
                 
-                brand_match = re.search(r'\b([A-Z][a-zA-Z]+)\b', text)
+                brand_match = PARSER_BRAND_RE.search(text)
                 if brand_match:
                     self.brands.add(brand_match.group(1))
             
             self.current_text = ''
             self.in_product = False
 
+@coalesced('wikipedia', key=lambda query: normalize_query(query))
+@traced('wikipedia')
 def search_wikipedia(query: str) -> str:
     encoded_query = urllib.parse.quote(query)
     search_url = f"https://ru.wikipedia.org/w/api.php?action=query&list=search&srsearch={encoded_query}&utf8=&format=json&srlimit=1"
@@ -48,8 +120,7 @@ def search_wikipedia(query: str) -> str:
         headers={'User-Agent': 'Mozilla/5.0 (compatible; SEOAnalyzerBot/1.0)'}
     )
     
-    with urllib.request.urlopen(req, timeout=10) as response:
-        data = json.loads(response.read().decode('utf-8'))
+    data = json.loads(fetch(req, timeout=10).body.decode('utf-8'))
     
     results = data.get('query', {}).get('search', [])
     
@@ -62,6 +133,7 @@ def search_wikipedia(query: str) -> str:
     
     return ''
 
+@coalesced('category', key=lambda url: normalize_url(url))
 def analyze_category_page(url: str) -> Dict:
     try:
         req = urllib.request.Request(
@@ -69,53 +141,62 @@ def analyze_category_page(url: str) -> Dict:
             headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         )
         
-        with urllib.request.urlopen(req, timeout=15) as response:
-            html = response.read().decode('utf-8', errors='ignore')
-        
-        parser = ProductParser()
-        parser.feed(html)
-        
-        title_match = re.search(r'<title[^>]*>(.*?)</title>', html, re.IGNORECASE | re.DOTALL)
-        page_title = title_match.group(1).strip() if title_match else ''
-        
-        h1_match = re.search(r'<h1[^>]*>(.*?)</h1>', html, re.IGNORECASE | re.DOTALL)
-        h1_text = re.sub(r'<[^>]+>', '', h1_match.group(1)).strip() if h1_match else ''
-        
-        brand_patterns = [
-            r'"brand"[:\s]+"([^"]+)"',
-            r'data-brand="([^"]+)"',
-            r'"manufacturer"[:\s]+"([^"]+)"',
-            r'\b(Apple|Samsung|Xiaomi|Huawei|Sony|LG|Nokia|Realme|OPPO|Vivo|OnePlus|Google|Asus|Lenovo|Motorola|HTC|Honor|ZTE|Meizu|TCL)\b'
-        ]
+        with span('fetch'):
+            html = fetch(req, timeout=15).body.decode('utf-8', errors='ignore')
         
-        brands_found = set()
-        for pattern in brand_patterns:
-            matches = re.findall(pattern, html, re.IGNORECASE)
-            brands_found.update([b.strip() for b in matches if len(b.strip()) > 1])
-        
-        if not brands_found and parser.brands:
-            brands_found = parser.brands
-        
-        price_matches = re.findall(r'(\d[\d\s]{3,})\s*(?:₽|руб)', html)
-        estimated_products = max(len(price_matches) // 2, 10) if price_matches else 10
-        
-        words = re.findall(r'\b[а-яА-ЯёЁ]{4,}\b', html.lower())
-        word_freq = Counter(words)
-        stop_words = {'этот', 'того', 'этого', 'можно', 'есть', 'быть', 'очень', 'более', 'самый', 'который', 'весь', 'товар', 'цена', 'рубль', 'купить'}
-        keywords = [word for word, count in word_freq.most_common(50) if word not in stop_words and count > 5][:10]
-        
-        return {
-            'products': parser.products[:20] if parser.products else [],
-            'brands': list(brands_found)[:10],
-            'page_title': page_title,
-            'h1': h1_text,
-            'keywords': keywords,
-            'total_products': max(len(parser.products), estimated_products)
-        }
+        with span('parse'):
+            return parse_category_html(html)
     
     except Exception as e:
         raise Exception(f"Ошибка при анализе страницы: {str(e)}")
 
+def parse_category_html(html: str) -> Dict:
+    '''Разбор HTML страницы категории (без загрузки)'''
+    parser = ProductParser()
+    parser.feed(html)
+    
+    title_match = TITLE_RE.search(html)
+    page_title = title_match.group(1).strip() if title_match else ''
+    
+    h1_match = H1_RE.search(html)
+    h1_text = TAG_RE.sub('', h1_match.group(1)).strip() if h1_match else ''
+    
+    brands_found = set()
+    for pattern in CATEGORY_BRAND_PATTERNS:
+        matches = pattern.findall(html)
+        brands_found.update([b.strip() for b in matches if len(b.strip()) > 1])
+    
+    if not brands_found and parser.brands:
+        brands_found = parser.brands
+    
+    price_matches = CATEGORY_PRICE_RE.findall(html)
+    estimated_products = max(len(price_matches) // 2, 10) if price_matches else 10
+    
+    words = RUSSIAN_WORD_RE.findall(html.lower())
+    word_freq = Counter(words)
+    keywords = [word for word, count in word_freq.most_common(50) if word not in STOP_WORDS and count > 5][:10]
+    
+    return {
+        'products': parser.products[:20] if parser.products else [],
+        'brands': list(brands_found)[:10],
+        'page_title': page_title,
+        'h1': h1_text,
+        'keywords': keywords,
+        'total_products': max(len(parser.products), estimated_products)
+    }
+
+@lru_cache(maxsize=1024)
+def brand_link_patterns(brand_name: str) -> tuple:
+    '''Шаблоны ссылок на страницу бренда; бренды повторяются, поэтому компиляция кэшируется'''
+    brand = re.escape(brand_name)
+    return tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+        rf'<a[^>]+href="([^"]*brand[^"]*{brand}[^"]*)"',
+        rf'<a[^>]+href="([^"]*{brand}[^"]*brand[^"]*)"',
+        rf'<a[^>]+href="([^"]*производител[^"]*{brand}[^"]*)"',
+        rf'<a[^>]+href="([^"]*brendy[^"]*{brand}[^"]*)"',
+        rf'<a[^>]+href="([^"]*brands[^"]*{brand}[^"]*)"'
+    ))
+
 def find_brand_page_url(html: str, product_url: str, brand_name: str) -> str:
     '''Ищет ссылку на страницу бренда в HTML товара'''
     if not brand_name:
@@ -123,16 +204,8 @@ def find_brand_page_url(html: str, product_url: str, brand_name: str) -> str:
     
     base_url = '/'.join(product_url.split('/')[:3])
     
-    brand_link_patterns = [
-        rf'<a[^>]+href="([^"]*brand[^"]*{re.escape(brand_name)}[^"]*)"',
-        rf'<a[^>]+href="([^"]*{re.escape(brand_name)}[^"]*brand[^"]*)"',
-        rf'<a[^>]+href="([^"]*производител[^"]*{re.escape(brand_name)}[^"]*)"',
-        rf'<a[^>]+href="([^"]*brendy[^"]*{re.escape(brand_name)}[^"]*)"',
-        rf'<a[^>]+href="([^"]*brands[^"]*{re.escape(brand_name)}[^"]*)"'
-    ]
-    
-    for pattern in brand_link_patterns:
-        match = re.search(pattern, html, re.IGNORECASE)
+    for pattern in brand_link_patterns(brand_name):
+        match = pattern.search(html)
         if match:
             url = match.group(1)
             if url.startswith('http'):
@@ -152,29 +225,20 @@ def extract_brand_info_from_page(url: str) -> str:
             headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         )
         
-        with urllib.request.urlopen(req, timeout=15) as response:
-            html = response.read().decode('utf-8', errors='ignore')
+        html = fetch(req, timeout=15).body.decode('utf-8', errors='ignore')
         
-        desc_patterns = [
-            r'<div[^>]*class="[^"]*brand[_-]?description[^"]*"[^>]*>(.*?)</div>',
-            r'<div[^>]*class="[^"]*about[_-]?brand[^"]*"[^>]*>(.*?)</div>',
-            r'<div[^>]*class="[^"]*description[^"]*"[^>]*>(.*?)</div>',
-            r'<section[^>]*class="[^"]*brand[^"]*"[^>]*>(.*?)</section>',
-            r'<article[^>]*>(.*?)</article>'
-        ]
-        
-        for pattern in desc_patterns:
-            match = re.search(pattern, html, re.IGNORECASE | re.DOTALL)
+        for pattern in BRAND_DESC_PATTERNS:
+            match = pattern.search(html)
             if match:
-                text = re.sub(r'<[^>]+>', ' ', match.group(1))
-                text = re.sub(r'\s+', ' ', text).strip()
+                text = TAG_RE.sub(' ', match.group(1))
+                text = SPACES_RE.sub(' ', text).strip()
                 if len(text) > 100:
                     return text[:800] if len(text) > 800 else text
         
-        paragraphs = re.findall(r'<p[^>]*>(.*?)</p>', html, re.IGNORECASE | re.DOTALL)
+        paragraphs = PARAGRAPH_RE.findall(html)
         if paragraphs:
-            combined_text = ' '.join([re.sub(r'<[^>]+>', '', p).strip() for p in paragraphs[:5]])
-            combined_text = re.sub(r'\s+', ' ', combined_text).strip()
+            combined_text = ' '.join([TAG_RE.sub('', p).strip() for p in paragraphs[:5]])
+            combined_text = SPACES_RE.sub(' ', combined_text).strip()
             if len(combined_text) > 100:
                 return combined_text[:800] if len(combined_text) > 800 else combined_text
         
@@ -182,110 +246,177 @@ def extract_brand_info_from_page(url: str) -> str:
     except Exception as e:
         return ''
 
-def analyze_product_page(url: str, use_ai: bool = True) -> Dict:
+def fetch_page(url: str, timeout: int = 15, validators: Optional[Dict] = None) -> Optional[Tuple[str, str, str]]:
+    '''
+    Загружает страницу: (html, ETag, Last-Modified).
+
+    С validators (etag/last_modified прошлой загрузки) запрос условный;
+    None означает, что страница не изменилась (304 Not Modified).
+    '''
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    
+    req = urllib.request.Request(url, headers=headers)
     try:
-        req = urllib.request.Request(
-            url,
-            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        )
-        
-        with urllib.request.urlopen(req, timeout=15) as response:
-            html = response.read().decode('utf-8', errors='ignore')
-        
-        title_match = re.search(r'<title[^>]*>(.*?)</title>', html, re.IGNORECASE | re.DOTALL)
-        page_title = re.sub(r'<[^>]+>', '', title_match.group(1)).strip() if title_match else ''
-        
-        h1_match = re.search(r'<h1[^>]*>(.*?)</h1>', html, re.IGNORECASE | re.DOTALL)
-        h1_text = re.sub(r'<[^>]+>', '', h1_match.group(1)).strip() if h1_match else ''
-        
-        product_name = h1_text or page_title.split('|')[0].strip()
-        
-        brand_patterns = [
-            r'"brand"[:\s]*"([^"]+)"',
-            r'data-brand="([^"]+)"',
-            r'"manufacturer"[:\s]*"([^"]+)"',
-            r'Бренд[:\s]*([А-ЯA-Z][а-яa-z]+)',
-            r'Производитель[:\s]*([А-ЯA-Z][а-яa-z]+)'
-        ]
-        
-        brand = ''
-        for pattern in brand_patterns:
-            match = re.search(pattern, html, re.IGNORECASE)
-            if match:
-                brand = match.group(1).strip()
-                break
-        
-        price_patterns = [
-            r'(\d[\d\s]{3,})\s*₽',
-            r'(\d[\d\s]{3,})\s*руб',
-            r'"price"[:\s]*"?(\d+)"?',
-            r'data-price="(\d+)"'
-        ]
-        
-        price = ''
-        for pattern in price_patterns:
-            match = re.search(pattern, html)
-            if match:
-                price_num = match.group(1).replace(' ', '')
-                price = f"{price_num} ₽"
-                break
-        
-        desc_patterns = [
-            r'<meta[^>]+name=["\']description["\'][^>]+content=["\']([^"\']+)',
-            r'"description"[:\s]*"([^"]+)"',
-            r'<div[^>]*class="[^"]*description[^"]*"[^>]*>(.*?)</div>'
-        ]
-        
-        description = ''
-        for pattern in desc_patterns:
-            match = re.search(pattern, html, re.IGNORECASE | re.DOTALL)
-            if match:
-                description = re.sub(r'<[^>]+>', '', match.group(1)).strip()[:500]
-                break
+        response = fetch(req, timeout=timeout)
+        html = response.body.decode('utf-8', errors='ignore')
+        return html, response.headers.get('ETag', ''), response.headers.get('Last-Modified', '')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and validators:
+            return None
+        raise
+
+def parse_product_html(html: str) -> Dict:
+    '''Разбор HTML карточки товара (без загрузки) в basic_data'''
+    title_match = TITLE_RE.search(html)
+    page_title = TAG_RE.sub('', title_match.group(1)).strip() if title_match else ''
+    
+    h1_match = H1_RE.search(html)
+    h1_text = TAG_RE.sub('', h1_match.group(1)).strip() if h1_match else ''
+    
+    product_name = h1_text or page_title.split('|')[0].strip()
+    
+    brand = ''
+    for pattern in PRODUCT_BRAND_PATTERNS:
+        match = pattern.search(html)
+        if match:
+            brand = match.group(1).strip()
+            break
+    
+    price = ''
+    for pattern in PRODUCT_PRICE_PATTERNS:
+        match = pattern.search(html)
+        if match:
+            price_num = match.group(1).replace(' ', '')
+            price = f"{price_num} ₽"
+            break
+    
+    description = ''
+    for pattern in PRODUCT_DESC_PATTERNS:
+        match = pattern.search(html)
+        if match:
+            description = TAG_RE.sub('', match.group(1)).strip()[:500]
+            break
+    
+    spec_section = TABLE_RE.search(html)
+    specifications = []
+    if spec_section:
+        rows = ROW_RE.findall(spec_section.group(1))
+        for row in rows[:15]:
+            cells = CELL_RE.findall(row)
+            if len(cells) >= 2:
+                key = TAG_RE.sub('', cells[0]).strip()
+                value = TAG_RE.sub('', cells[1]).strip()
+                if key and value:
+                    specifications.append(f"{key}: {value}")
+    
+    return {
+        'product_name': product_name,
+        'brand': brand,
+        'price': price,
+        'description': description,
+        'specifications': specifications,
+        'page_title': page_title,
+        'h1': h1_text
+    }
+
+@coalesced('product', key=lambda url, use_ai=True, force=False: (normalize_url(url), use_ai, force))
+def analyze_product_page(url: str, use_ai: bool = True, force: bool = False) -> Dict:
+    '''
+    Анализ карточки товара.
+
+    При повторном анализе того же URL (SEO_INCREMENTAL) сохраненный отпечаток
+    полей определяет поле change: unchanged и price_only возвращают прошлый
+    результат (с новой ценой) без разбора бренда и AI-вызова, new и
+    content_changed проходят полный анализ. force=True всегда делает полный анализ.
+    '''
+    try:
+        previous = get_fingerprint(url) if INCREMENTAL else None
+        # Прошлый результат годится, только если в нем есть AI-анализ, когда он нужен сейчас
+        # (анализ без модели по той же странице маршрутизатор выбрал бы снова)
+        reusable = previous if previous and not force and (
+            not use_ai or previous['result']['has_ai_analysis'] or not ai_configured()
+        ) else None
+        
+        with span('fetch'):
+            page = fetch_page(url, validators=reusable)
+        
+        if page is None:
+            touch_fingerprint(url)
+            return {**reusable['result'], 'change': UNCHANGED}
+        
+        html, etag, last_modified = page
+        
+        with span('parse'):
+            basic_data = parse_product_html(html)
+        
+        current = fingerprint(basic_data)
+        change = classify(previous, current)
+        
+        if reusable and change in (UNCHANGED, PRICE_ONLY):
+            result = reusable['result']
+            if change == PRICE_ONLY:
+                result = {
+                    **result,
+                    'price': basic_data['price'],
+                    'basic_data': {**result['basic_data'], 'price': basic_data['price']}
+                }
+            save_fingerprint(url, current, result, etag, last_modified,
+                             changed_at=reusable['changed_at'] if change == UNCHANGED else None)
+            return {**result, 'change': change}
         
-        spec_section = re.search(r'<table[^>]*>(.*?)</table>', html, re.IGNORECASE | re.DOTALL)
-        specifications = []
-        if spec_section:
-            rows = re.findall(r'<tr[^>]*>(.*?)</tr>', spec_section.group(1), re.IGNORECASE | re.DOTALL)
-            for row in rows[:15]:
-                cells = re.findall(r'<t[dh][^>]*>(.*?)</t[dh]>', row, re.IGNORECASE | re.DOTALL)
-                if len(cells) >= 2:
-                    key = re.sub(r'<[^>]+>', '', cells[0]).strip()
-                    value = re.sub(r'<[^>]+>', '', cells[1]).strip()
-                    if key and value:
-                        specifications.append(f"{key}: {value}")
+        product_name = basic_data['product_name']
+        brand = basic_data['brand']
+        price = basic_data['price']
         
         brand_page_url = ''
         brand_page_info = ''
         if brand:
-            brand_page_url = find_brand_page_url(html, url, brand)
-            if brand_page_url:
-                brand_page_info = extract_brand_info_from_page(brand_page_url)
-        
-        basic_data = {
-            'product_name': product_name,
-            'brand': brand,
-            'price': price,
-            'description': description,
-            'specifications': specifications,
-            'page_title': page_title,
-            'h1': h1_text
-        }
+            with span('brand_page'):
+                brand_page_url = find_brand_page_url(html, url, brand)
+                if brand_page_url:
+                    brand_page_info = extract_brand_info_from_page(brand_page_url)
         
         ai_analysis = None
+        deterministic = None
+        variant = None
         if use_ai:
-            ai_analysis = analyze_product_with_ai(html, basic_data)
-        
-        return {
+            # Вариант уже проанализированного товара (другой цвет, объем) не требует нового вызова LLM
+            with span('variants'):
+                variant = find_variant(basic_data, url)
+            if variant:
+                ai_analysis = variant['analysis']
+            else:
+                with span('ai'):
+                    ai_analysis = analyze_product_with_ai(html, basic_data)
+                if ai_analysis:
+                    with span('variants'):
+                        remember_analysis(url, basic_data, ai_analysis)
+                else:
+                    # Без модели полная карточка все равно получает поля со страницы и SEO-мета;
+                    # это не AI-анализ, поэтому он не попадает ни в индекс вариантов, ни в ai_analysis
+                    deterministic = deterministic_product_analysis(html, basic_data)
+        
+        result = {
             'product_name': ai_analysis.get('full_name', product_name) if ai_analysis else product_name,
             'brand': brand,
             'price': price,
             'brand_page_url': brand_page_url,
             'brand_page_info': brand_page_info,
             'ai_analysis': ai_analysis,
+            'deterministic_analysis': deterministic,
             'basic_data': basic_data,
-            'has_ai_analysis': ai_analysis is not None
+            'has_ai_analysis': ai_analysis is not None,
+            'analysis_source': 'ai_analysis' if ai_analysis else 'deterministic' if deterministic else 'basic_parsing',
+            'variant_of': {key: variant[key] for key in ('variant_of', 'similarity', 'patched')} if variant else None
         }
+        if INCREMENTAL:
+            save_fingerprint(url, current, result, etag, last_modified)
+        return {**result, 'change': change}
     
     except Exception as e:
         raise Exception(f"Ошибка при анализе товара: {str(e)}")
@@ -317,6 +448,48 @@ def generate_category_description(analysis: Dict, category_name: str) -> str:
     
     return description
 
+def product_payload(analysis: Dict, url: str) -> Dict:
+    '''Поля ответа по одному товару (общие для type product и products)'''
+    with span('format'):
+        if analysis['has_ai_analysis']:
+            extracted_text = format_extracted_data(analysis['ai_analysis'], analysis['basic_data'])
+        else:
+            extracted_text = format_extracted_data(analysis.get('deterministic_analysis'), analysis['basic_data'])
+    
+    return {
+        'url': url,
+        'product_name': analysis['product_name'],
+        'brand': analysis['brand'],
+        'brand_page_url': analysis.get('brand_page_url', ''),
+        'brand_page_info': analysis.get('brand_page_info', ''),
+        'extracted_data': extracted_text,
+        'has_ai_analysis': analysis['has_ai_analysis'],
+        'ai_analysis': analysis['ai_analysis'],
+        'deterministic_analysis': analysis.get('deterministic_analysis'),
+        'variant_of': analysis['variant_of'],
+        'change': analysis['change'],
+        'source': analysis.get('analysis_source') or ('ai_analysis' if analysis['has_ai_analysis'] else 'basic_parsing')
+    }
+
+def analyze_products(urls: List[str], priority: int = BACKGROUND, force: bool = False) -> List[Dict]:
+    '''
+    Пакетный анализ товаров в порядке urls.
+
+    Разные магазины обходятся параллельно, а вежливость к каждому хосту
+    (лимиты, Crawl-delay, замедление на 429/503) обеспечивает планировщик загрузок.
+    '''
+    def run(url: str) -> Dict:
+        with crawl_priority(priority):
+            try:
+                return {'status': 'ok', **product_payload(analyze_product_page(url, use_ai=True, force=force), url)}
+            except Exception as e:
+                return {'url': url, 'status': 'error', 'error': str(e)}
+    
+    with ThreadPoolExecutor(max_workers=min(BULK_CONCURRENCY, len(urls))) as executor:
+        # Копия контекста переносит трассировку запроса в рабочие потоки
+        return list(executor.map(lambda url: contextvars.copy_context().run(run, url), urls))
+
+@traced_handler
 def handler(event: dict, context) -> dict:
     '''SEO-анализатор: поиск информации о брендах и анализ категорий для генерации контента'''
     
@@ -328,7 +501,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Debug-Timing'
             },
             'body': ''
         }
@@ -405,12 +578,11 @@ def handler(event: dict, context) -> dict:
                     'body': json.dumps({'error': 'productUrl is required'})
                 }
             
-            analysis = analyze_product_page(product_url, use_ai=True)
+            analysis = analyze_product_page(product_url, use_ai=True, force=bool(body.get('force')))
+            payload = product_payload(analysis, product_url)
             
-            if analysis['has_ai_analysis']:
-                extracted_text = format_extracted_data(analysis['ai_analysis'], analysis['basic_data'])
-            else:
-                extracted_text = format_extracted_data(None, analysis['basic_data'])
+            with span('encode'):
+                response_body = json.dumps({'type': 'product', **payload}, ensure_ascii=False)
             
             return {
                 'statusCode': 200,
@@ -418,17 +590,43 @@ def handler(event: dict, context) -> dict:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'type': 'product',
-                    'product_name': analysis['product_name'],
-                    'brand': analysis['brand'],
-                    'brand_page_url': analysis.get('brand_page_url', ''),
-                    'brand_page_info': analysis.get('brand_page_info', ''),
-                    'extracted_data': extracted_text,
-                    'has_ai_analysis': analysis['has_ai_analysis'],
-                    'ai_analysis': analysis['ai_analysis'],
-                    'source': 'ai_analysis' if analysis['has_ai_analysis'] else 'basic_parsing'
+                'body': response_body
+            }
+        
+        elif analysis_type == 'products':
+            product_urls = [
+                url.strip() for url in body.get('productUrls') or []
+                if isinstance(url, str) and url.strip()
+            ]
+            
+            if not product_urls or len(product_urls) > MAX_BULK_URLS:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': f'productUrls must contain 1-{MAX_BULK_URLS} URLs'})
+                }
+            
+            priority = INTERACTIVE if body.get('priority') == 'interactive' else BACKGROUND
+            results = analyze_products(product_urls, priority, force=bool(body.get('force')))
+            
+            with span('encode'):
+                response_body = json.dumps({
+                    'type': 'products',
+                    'results': results,
+                    'total': len(results),
+                    'failed': sum(1 for item in results if item['status'] == 'error')
                 }, ensure_ascii=False)
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': response_body
             }
         
         elif analysis_type == 'category':
@@ -458,18 +656,85 @@ def handler(event: dict, context) -> dict:
             analysis = analyze_category_page(category_url)
             description = generate_category_description(analysis, category_name)
             
+            with span('encode'):
+                response_body = json.dumps({
+                    'type': 'category',
+                    'url': category_url,
+                    'category_name': category_name,
+                    'description': description,
+                    'analysis': analysis,
+                    'source': 'page_analysis'
+                })
+            
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'type': 'category',
-                    'description': description,
-                    'analysis': analysis,
-                    'source': 'page_analysis'
-                })
+                'body': response_body
+            }
+        
+        elif analysis_type == 'export':
+            results = body.get('results')
+            export_format = body.get('format', 'csv')
+            
+            if not isinstance(results, list) or not results or export_format not in EXPORT_FORMATS:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': f'results (list) and format ({", ".join(EXPORT_FORMATS)}) are required'})
+                }
+            
+            table_prefix = body.get('tablePrefix', DEFAULT_PREFIX)
+            language_id = body.get('languageId', DEFAULT_LANGUAGE_ID)
+            if isinstance(language_id, str) and language_id.isdigit():
+                language_id = int(language_id)
+            
+            if (not isinstance(table_prefix, str) or not EXPORT_PREFIX_RE.match(table_prefix)
+                    or isinstance(language_id, bool) or not isinstance(language_id, int) or language_id < 1):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'tablePrefix must match [A-Za-z0-9_]{0,32} and languageId must be a positive integer'})
+                }
+            
+            buffer = io.StringIO()
+            with span('export'):
+                stats = write_export(
+                    results, buffer, export_format,
+                    entity=body.get('entity') if body.get('entity') in EXPORT_ENTITIES else None,
+                    prefix=table_prefix,
+                    language_id=language_id
+                )
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+                    'Content-Disposition': f'attachment; filename="seo-export.{export_format}"',
+                    'Access-Control-Allow-Origin': '*',
+                    'X-Export-Rows': str(stats['rows']),
+                    'X-Export-Skipped': str(stats['skipped'])
+                },
+                'body': buffer.getvalue()
+            }
+        
+        elif analysis_type == 'stats':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'type': 'stats', 'coalescing': flights.stats(), 'hosts': scheduler.stats(),
+                                    'routing': route_stats.snapshot()})
             }
         
         else:
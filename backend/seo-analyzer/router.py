@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Маршрутизация AI-анализа по тому, сколько уже нашел разбор регулярками:
+# у богатой карточки поля со страницы заполняются без LLM, а модель коротким
+# запросом пишет только продающие тексты и SEO-мета; средняя карточка идет
+# коротким запросом за всеми недостающими полями, бедная — полным анализом HTML
+ROUTER_ENABLED = os.environ.get('SEO_ROUTER', '1') != '0'
+DETERMINISTIC_SCORE = float(os.environ.get('ROUTER_DETERMINISTIC_SCORE', '0.85'))
+REDUCED_SCORE = float(os.environ.get('ROUTER_REDUCED_SCORE', '0.45'))
+REDUCED_MODEL = os.environ.get('ROUTER_REDUCED_MODEL', 'gpt-4o-mini')
+FULL_MODEL = os.environ.get('ROUTER_FULL_MODEL', 'gpt-4o-mini')
+# Потолок ответа сокращенного запроса: он дописывает только часть полей
+REDUCED_MAX_TOKENS = int(os.environ.get('ROUTER_REDUCED_MAX_TOKENS', '1200'))
+
+DETERMINISTIC = 'deterministic'
+REDUCED = 'reduced'
+FULL = 'full'
+
+# Цена за 1M токенов (вход, выход), USD
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4.1-nano': (0.10, 0.40),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1': (2.00, 8.00)
+}
+
+# Насыщение признаков сложности: больше этого считается "полной" карточкой
+SPEC_SATURATION = 8
+DESCRIPTION_SATURATION = 300
+MIN_DESCRIPTION = 200
+MIN_FEATURES = 3
+
+# Поля, которые пишет только модель: на уровне deterministic запрос идет лишь за ними
+COPY_FIELDS = ('advantages', 'target_audience', 'use_cases', 'seo_meta', 'lsi_phrases', 'selling_points')
+SEO_TITLE_LENGTH = 60
+SEO_DESCRIPTION_LENGTH = 160
+
+SCHEMA_FIELDS = (
+    'full_name', 'description', 'key_features', 'advantages', 'specifications',
+    'visual_details', 'target_audience', 'use_cases', 'seo_meta', 'lsi_phrases', 'selling_points'
+)
+
+# Описание полей для сокращенного запроса (фрагменты схемы полного промпта)
+FIELD_SCHEMA = {
+    'full_name': '"full_name": "Точное полное название товара с артикулом/модификацией"',
+    'description': '"description": "Подробное описание товара (2-3 абзаца) с техническими деталями"',
+    'key_features': '"key_features": ["Список ключевых особенностей", "минимум 5-7 пунктов"]',
+    'advantages': '"advantages": ["Преимущества товара", "почему стоит купить", "минимум 5 пунктов"]',
+    'specifications': '"specifications": {"Категория 1": {"Параметр": "Значение"}}',
+    'visual_details': '"visual_details": {"color": "Основной цвет", "material": "Материал", "form_factor": "Форма, размеры, дизайн"}',
+    'target_audience': '"target_audience": "Для кого предназначен товар"',
+    'use_cases': '"use_cases": ["Примеры использования", "сценарии применения"]',
+    'seo_meta': '"seo_meta": {"title": "Title до 60 символов", "description": "Meta Description до 160 символов", "h1": "H1", "keywords": ["ключевое слово"]}',
+    'lsi_phrases': '"lsi_phrases": ["LSI-фраза", "минимум 10 фраз"]',
+    'selling_points': '"selling_points": ["УТП", "что выделяет среди конкурентов"]'
+}
+
+REDUCED_PROMPT_TEMPLATE = """Данные товара уже извлечены со страницы интернет-магазина:
+
+{product_data}
+
+Дополни SEO-контент для этого товара. Верни JSON только с полями:
+{{
+  {fields}
+}}
+
+Опирайся только на данные выше, не придумывай характеристики. Пиши на русском языке, продающим и профессиональным тоном."""
+
+JSON_LD_RE = re.compile(r'<script[^>]+application/ld\+json[^>]*>(.*?)</script>', re.IGNORECASE | re.DOTALL)
+SPEC_LINE_RE = re.compile(r'^([^:]+):\s*(.+)$')
+
+VISUAL_KEYS = {
+    'color': ('цвет', 'color'),
+    'material': ('материал', 'material'),
+    'form_factor': ('размер', 'габарит', 'форм', 'корпус')
+}
+
+
+def has_product_json_ld(html: str) -> bool:
+    return any('product' in block.lower() for block in JSON_LD_RE.findall(html))
+
+
+def complexity_score(basic_data: Dict, html: str) -> float:
+    '''0..1: насколько полно карточка описана тем, что уже извлек разбор'''
+    specs = min(len(basic_data.get('specifications') or []) / SPEC_SATURATION, 1.0)
+    description = min(len(basic_data.get('description') or '') / DESCRIPTION_SATURATION, 1.0)
+    return round(0.45 * specs + 0.35 * description + 0.2 * has_product_json_ld(html), 3)
+
+
+def choose_tier(score: float) -> str:
+    if not ROUTER_ENABLED:
+        return FULL
+    if score >= DETERMINISTIC_SCORE:
+        return DETERMINISTIC
+    if score >= REDUCED_SCORE:
+        return REDUCED
+    return FULL
+
+
+def parse_specs(basic_data: Dict) -> List[Tuple[str, str]]:
+    specs = []
+    for line in basic_data.get('specifications') or []:
+        match = SPEC_LINE_RE.match(line)
+        if match:
+            specs.append((match.group(1).strip(), match.group(2).strip()))
+    return specs
+
+
+def deterministic_analysis(basic_data: Dict) -> Tuple[Dict, List[str]]:
+    '''
+    Поля анализа, которые следуют из уже извлеченных данных, без LLM.
+
+    Возвращает анализ (только найденные поля) и список полей схемы, которых
+    в нем нет: продающие тексты и SEO-мета пишет только модель.
+    '''
+    name = basic_data.get('product_name', '')
+    brand = basic_data.get('brand', '')
+    description = basic_data.get('description', '')
+    specs = parse_specs(basic_data)
+
+    visual_details = {}
+    for field, markers in VISUAL_KEYS.items():
+        for key, value in specs:
+            if any(marker in key.lower() for marker in markers):
+                visual_details[field] = value
+                break
+
+    analysis = {}
+    if name:
+        analysis['full_name'] = name if not brand or brand.lower() in name.lower() else f'{brand} {name}'
+    if len(description) >= MIN_DESCRIPTION:
+        analysis['description'] = description
+    if len(specs) >= MIN_FEATURES:
+        analysis['key_features'] = [f'{key}: {value}' for key, value in specs[:7]]
+        analysis['specifications'] = {'Основные характеристики': dict(specs)}
+    if len(visual_details) == len(VISUAL_KEYS):
+        analysis['visual_details'] = visual_details
+
+    missing = [field for field in SCHEMA_FIELDS if field not in analysis]
+    return analysis, missing
+
+
+def shorten(text: str, limit: int) -> str:
+    text = ' '.join((text or '').split())
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1].rsplit(' ', 1)[0] + '…'
+
+
+def parsed_seo_meta(basic_data: Dict, analysis: Dict) -> Dict:
+    '''SEO-мета из извлеченных полей: для карточки уровня deterministic, когда модель недоступна'''
+    name = analysis.get('full_name') or basic_data.get('product_name', '')
+    brand = basic_data.get('brand', '')
+    description = analysis.get('description') or basic_data.get('description', '')
+    keywords = [name] if name else []
+    if brand and brand.lower() not in name.lower():
+        keywords.append(brand)
+    keywords.extend(f'{name} {value}' for key, value in parse_specs(basic_data)
+                    if any(marker in key.lower() for markers in VISUAL_KEYS.values() for marker in markers))
+    title = f'{name} — купить' if name else ''
+    return {
+        'title': title if len(title) <= SEO_TITLE_LENGTH else shorten(name, SEO_TITLE_LENGTH),
+        'description': shorten(description, SEO_DESCRIPTION_LENGTH),
+        'h1': name,
+        'keywords': keywords[:10]
+    }
+
+
+def reduced_prompt(basic_data: Dict, fields: List[str]) -> str:
+    product_data = json.dumps({
+        'Название': basic_data.get('product_name', ''),
+        'Бренд': basic_data.get('brand', ''),
+        'Цена': basic_data.get('price', ''),
+        'Описание': basic_data.get('description', ''),
+        'Характеристики': basic_data.get('specifications') or []
+    }, ensure_ascii=False, indent=2)
+    return REDUCED_PROMPT_TEMPLATE.format(
+        product_data=product_data,
+        fields=',\n  '.join(FIELD_SCHEMA[field] for field in fields)
+    )
+
+
+def completeness(analysis: Optional[Dict]) -> float:
+    '''Доля заполненных полей схемы полного анализа'''
+    if not analysis:
+        return 0.0
+    return round(sum(1 for field in SCHEMA_FIELDS if analysis.get(field)) / len(SCHEMA_FIELDS), 3)
+
+
+def request_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, MODEL_PRICES['gpt-4o-mini'])
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class RouteStats:
+    '''Итоги маршрутизации с момента старта контейнера: средние задержка и стоимость по уровням'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+    def record(self, decision: Dict) -> None:
+        with self.lock:
+            totals = self.totals[decision['tier']]
+            totals['count'] += 1
+            totals['latency_ms'] += decision['latency_ms']
+            totals['cost_usd'] += decision['cost_usd']
+            totals['completeness'] += decision['completeness']
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            result = {}
+            for tier, totals in self.totals.items():
+                count = totals['count'] or 1
+                result[tier] = {
+                    'count': int(totals['count']),
+                    'avg_latency_ms': round(totals['latency_ms'] / count, 1),
+                    'avg_cost_usd': round(totals['cost_usd'] / count, 6),
+                    'avg_completeness': round(totals['completeness'] / count, 3)
+                }
+            return result
+
+
+route_stats = RouteStats()
+
+
+def decision(tier: str, score: float, model: str, missing: List[str], started: float,
+             prompt_tokens: int, completion_tokens: int, result: Optional[Dict]) -> Dict:
+    '''Запись журнала маршрутизации: started — time.perf_counter() до выбора уровня'''
+    return {
+        'tier': tier,
+        'score': score,
+        'model': model,
+        'missing': missing,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'cost_usd': round(request_cost(model, prompt_tokens, completion_tokens), 6) if model else 0.0,
+        'completeness': completeness(result)
+    }
+
+
+def log_decision(decision: Dict) -> None:
+    route_stats.record(decision)
+    print(json.dumps({'event': 'ai_route', **decision}, ensure_ascii=False))
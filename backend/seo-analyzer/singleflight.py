@@ -0,0 +1,98 @@
+import copy
+import threading
+import urllib.parse
+from collections import Counter
+from functools import wraps
+from typing import Callable, Dict, Hashable
+
+from tracing import span
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Одновременные вызовы с одинаковым ключом выполняются один раз: первый
+    вызывающий считает результат, остальные ждут его и получают копию
+    (или то же исключение). Завершенные вызовы не кэшируются.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Call] = {}
+        self.counters = Counter()
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        name = key[0] if isinstance(key, tuple) else key
+        with self.lock:
+            self.counters[f'{name}.calls'] += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.counters[f'{name}.coalesced'] += 1
+
+        if not leader:
+            with span('coalesced'):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            result = {}
+            for counter, value in self.counters.items():
+                name, field = counter.rsplit('.', 1)
+                result.setdefault(name, {'calls': 0, 'coalesced': 0})[field] = value
+            return result
+
+
+flights = SingleFlight()
+
+
+def coalesced(name: str, key: Callable[..., Hashable]):
+    '''Декоратор: key(*args, **kwargs) строит ключ вызова из аргументов функции'''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return flights.do((name, key(*args, **kwargs)), fn, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def normalize_url(url: str) -> str:
+    '''Регистр схемы и хоста, порт по умолчанию, фрагмент, порядок параметров и завершающий "/" не важны'''
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    if port and (scheme, port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{port}'
+    path = parts.path.rstrip('/') or '/'
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, path, query, ''))
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
@@ -0,0 +1,155 @@
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+STATE_DIR = os.environ.get('SEO_STATE_DIR', tempfile.gettempdir())
+STATE_DB_PATH = os.path.join(STATE_DIR, 'seo-analyzer.sqlite3')
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS product_variants (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    brand TEXT NOT NULL,
+    basic_data TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    analysis TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS variant_buckets (
+    bucket INTEGER NOT NULL,
+    product_id INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS variant_buckets_bucket ON variant_buckets (bucket);
+CREATE INDEX IF NOT EXISTS variant_buckets_product ON variant_buckets (product_id);
+
+CREATE TABLE IF NOT EXISTS product_fingerprints (
+    url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    price TEXT NOT NULL,
+    description_hash TEXT NOT NULL,
+    spec_hash TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    result TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    changed_at REAL NOT NULL
+);
+'''
+
+
+def get_connection() -> sqlite3.Connection:
+    '''Одно соединение на процесс: переживает вызовы в "теплом" контейнере'''
+    global _connection
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                os.makedirs(STATE_DIR, exist_ok=True)
+                connection = sqlite3.connect(STATE_DB_PATH, check_same_thread=False, isolation_level=None)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.executescript(SCHEMA)
+                _connection = connection
+    return _connection
+
+
+def execute(sql: str, params: tuple = ()) -> list:
+    connection = get_connection()
+    with _lock:
+        return connection.execute(sql, params).fetchall()
+
+
+def variant_candidates(buckets: List[int], brand: str, exclude_url: str = '') -> List[Dict]:
+    '''Товары того же бренда (кроме exclude_url), попавшие хотя бы в одну LSH-корзину запроса'''
+    if not buckets:
+        return []
+    placeholders = ', '.join('?' * len(buckets))
+    rows = execute(
+        f'''SELECT id, url, basic_data, signature, analysis FROM product_variants
+            WHERE brand = ? AND url != ? AND id IN (
+                SELECT DISTINCT product_id FROM variant_buckets WHERE bucket IN ({placeholders})
+            )''',
+        (brand, exclude_url, *buckets)
+    )
+    return [
+        {
+            'id': product_id,
+            'url': url,
+            'basic_data': json.loads(basic_data),
+            'signature': signature,
+            'analysis': json.loads(analysis)
+        }
+        for product_id, url, basic_data, signature, analysis in rows
+    ]
+
+
+def remember_variant(url: str, brand: str, basic_data: Dict, signature: bytes,
+                     analysis: Dict, buckets: List[int]) -> None:
+    '''Индексирует проанализированный товар; повторный анализ того же URL заменяет запись'''
+    connection = get_connection()
+    with _lock:
+        with connection:
+            connection.execute('BEGIN')
+            row = connection.execute('SELECT id FROM product_variants WHERE url = ?', (url,)).fetchone()
+            if row:
+                connection.execute('DELETE FROM variant_buckets WHERE product_id = ?', (row[0],))
+                connection.execute('DELETE FROM product_variants WHERE id = ?', (row[0],))
+            cursor = connection.execute(
+                '''INSERT INTO product_variants (url, brand, basic_data, signature, analysis, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (url, brand, json.dumps(basic_data, ensure_ascii=False), signature,
+                 json.dumps(analysis, ensure_ascii=False), time.time())
+            )
+            connection.executemany(
+                'INSERT INTO variant_buckets (bucket, product_id) VALUES (?, ?)',
+                [(bucket, cursor.lastrowid) for bucket in buckets]
+            )
+
+
+def get_fingerprint(url: str) -> Optional[Dict]:
+    rows = execute(
+        '''SELECT name, brand, price, description_hash, spec_hash, etag, last_modified, result, changed_at
+           FROM product_fingerprints WHERE url = ?''',
+        (url,)
+    )
+    if not rows:
+        return None
+    name, brand, price, description_hash, spec_hash, etag, last_modified, result, changed_at = rows[0]
+    return {
+        'name': name,
+        'brand': brand,
+        'price': price,
+        'description_hash': description_hash,
+        'spec_hash': spec_hash,
+        'etag': etag,
+        'last_modified': last_modified,
+        'result': json.loads(result),
+        'changed_at': changed_at
+    }
+
+
+def save_fingerprint(url: str, fingerprint: Dict[str, str], result: Dict, etag: str = '',
+                     last_modified: str = '', changed_at: Optional[float] = None) -> None:
+    now = time.time()
+    execute(
+        '''INSERT OR REPLACE INTO product_fingerprints
+           (url, name, brand, price, description_hash, spec_hash, etag, last_modified, result, checked_at, changed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (url, fingerprint['name'], fingerprint['brand'], fingerprint['price'],
+         fingerprint['description_hash'], fingerprint['spec_hash'], etag, last_modified,
+         json.dumps(result, ensure_ascii=False), now, changed_at or now)
+    )
+
+
+def touch_fingerprint(url: str) -> None:
+    '''Страница не изменилась (304): обновляется только время проверки'''
+    execute('UPDATE product_fingerprints SET checked_at = ? WHERE url = ?', (time.time(), url))
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+
+# Разбивка времени в теле ответа для всех запросов (иначе — по заголовку X-Debug-Timing: 1)
+DEBUG_TIMING = os.environ.get('TRACE_DEBUG') == '1'
+# Порог медленного запроса для выборочного профилировщика, 0 — выключен
+PROFILE_SLOW_MS = float(os.environ.get('TRACE_PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL = 0.005
+PROFILE_DEPTH = 12
+PROFILE_TOP = 5
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    '''Суммарное время по именованным этапам одного запроса'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, duration: float) -> None:
+        with self.lock:
+            total, count = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (total + duration, count + 1)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> dict:
+        stages = {
+            name: {'ms': round(total * 1000, 2), 'count': count}
+            for name, (total, count) in self.stages.items()
+        }
+        return {'total_ms': round(self.elapsed() * 1000, 2), 'stages': stages}
+
+    def server_timing(self) -> str:
+        entries = [
+            f'{name};dur={total * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+            for name, (total, count) in self.stages.items()
+        ]
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def span(name: str):
+    '''Замер этапа; вне запроса (нет активной трассировки) почти ничего не стоит'''
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def traced(name: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StackSampler:
+    '''Периодически снимает стек потока запроса; дешевле cProfile и не меняет сам код'''
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='trace-sampler', daemon=True)
+
+    def start(self) -> 'StackSampler':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < PROFILE_DEPTH:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(stack)] += 1
+
+    def report(self) -> str:
+        total = sum(self.samples.values()) or 1
+        lines = []
+        for stack, count in self.samples.most_common(PROFILE_TOP):
+            lines.append(f'{count * 100 / total:5.1f}% ({count} samples)')
+            lines.extend(f'    {frame}' for frame in stack)
+        return '\n'.join(lines)
+
+
+def debug_requested(event: dict) -> bool:
+    if DEBUG_TIMING:
+        return True
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    params = event.get('queryStringParameters') or {}
+    return headers.get('x-debug-timing') == '1' or params.get('debug_timing') == '1'
+
+
+def traced_handler(handler):
+    '''
+    Оборачивает handler функции: заголовок Server-Timing в каждом ответе,
+    разбивка по этапам в теле (_timing) при отладке и дамп горячих стеков
+    для медленных запросов, если задан TRACE_PROFILE_SLOW_MS.
+    '''
+    @wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        trace = Trace()
+        token = _current_trace.set(trace)
+        sampler: Optional[StackSampler] = None
+        if PROFILE_SLOW_MS > 0:
+            sampler = StackSampler(threading.get_ident()).start()
+
+        try:
+            response = handler(event, context)
+        finally:
+            _current_trace.reset(token)
+            if sampler is not None:
+                sampler.stop()
+
+        elapsed_ms = trace.elapsed() * 1000
+        if sampler is not None and elapsed_ms > PROFILE_SLOW_MS:
+            print(f"Slow request ({elapsed_ms:.0f} ms, {trace.server_timing()}):\n{sampler.report()}")
+
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = trace.server_timing()
+        headers['Access-Control-Expose-Headers'] = 'Server-Timing'
+        response = {**response, 'headers': headers}
+
+        if debug_requested(event) and headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                body = json.loads(response.get('body') or '{}')
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                body['_timing'] = trace.breakdown()
+                response['body'] = json.dumps(body, ensure_ascii=False)
+
+        return response
+
+    return wrapper
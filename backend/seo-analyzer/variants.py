@@ -0,0 +1,172 @@
+import os
+import re
+import random
+import hashlib
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from state import variant_candidates, remember_variant
+
+# Вариант товара (цвет, объем памяти) переиспользует AI-анализ уже
+# проанализированной модели: сравнение по MinHash-подписи, поиск кандидатов
+# через LSH-корзины в SQLite, поэтому поиск не зависит от размера каталога
+VARIANT_REUSE = os.environ.get('SEO_VARIANT_REUSE', '1') != '0'
+VARIANT_THRESHOLD = float(os.environ.get('SEO_VARIANT_THRESHOLD', '0.7'))
+# Слишком короткие карточки совпадают случайно, их не индексируем
+MIN_FEATURES = 8
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+
+_random = random.Random(20240601)
+PERMUTATIONS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+WORD_RE = re.compile(r'[0-9a-zа-я]+(?:[.,][0-9]+)?')
+SPEC_RE = re.compile(r'^([^:]+):\s*(.+)$')
+NAME_TOKEN_RE = re.compile(r'\S+')
+# Короткие значения ("1", "Да") встречаются в тексте не только как атрибут
+MIN_REPLACEMENT_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    return ' '.join(WORD_RE.findall((text or '').lower().replace('ё', 'е')))
+
+
+def parse_specifications(specifications: List[str]) -> Dict[str, str]:
+    specs = {}
+    for line in specifications or []:
+        match = SPEC_RE.match(line)
+        if match:
+            specs[match.group(1).strip()] = match.group(2).strip()
+    return specs
+
+
+def features(basic_data: Dict) -> Set[str]:
+    '''
+    Признаки товара для сравнения: слова названия, пары "характеристика:
+    значение" и тройки слов описания. Цена в признаки не входит — у вариантов
+    она разная по определению.
+    '''
+    result = {f'n:{word}' for word in normalize(basic_data.get('product_name', '')).split()}
+    for key, value in parse_specifications(basic_data.get('specifications')).items():
+        result.add(f's:{normalize(key)}={normalize(value)}')
+    words = normalize(basic_data.get('description', '')).split()
+    result.update(f'd:{" ".join(words[i:i + 3])}' for i in range(max(len(words) - 2, 0)))
+    return result
+
+
+def signature(feature_set: Set[str]) -> List[int]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for feature in feature_set
+    ]
+    return [
+        min((a * value + b) % MERSENNE_PRIME for value in hashes)
+        for a, b in PERMUTATIONS
+    ]
+
+
+def lsh_buckets(sig: List[int]) -> List[int]:
+    '''Ключ корзины на каждую полосу подписи (знаковое 64-битное число для SQLite)'''
+    buckets = []
+    for band in range(BANDS):
+        data = array('Q', [band, *sig[band * ROWS:(band + 1) * ROWS]]).tobytes()
+        buckets.append(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big', signed=True))
+    return buckets
+
+
+def similarity(left: List[int], right: List[int]) -> float:
+    '''Оценка коэффициента Жаккара по доле совпавших минимумов'''
+    return sum(1 for a, b in zip(left, right) if a == b) / NUM_PERM
+
+
+def replacements(old: Dict, new: Dict) -> List[Tuple[str, str]]:
+    '''Пары "было -> стало" для отличающихся атрибутов варианта'''
+    pairs = []
+    old_name, new_name = old.get('product_name', ''), new.get('product_name', '')
+    if old_name and new_name and old_name != new_name:
+        pairs.append((old_name, new_name))
+        old_tokens = NAME_TOKEN_RE.findall(old_name)
+        new_tokens = NAME_TOKEN_RE.findall(new_name)
+        # Слова названия сопоставляются по позиции: "128GB Black" -> "256GB Blue"
+        if len(old_tokens) == len(new_tokens):
+            pairs.extend((a, b) for a, b in zip(old_tokens, new_tokens) if a != b)
+
+    old_specs = parse_specifications(old.get('specifications'))
+    new_specs = parse_specifications(new.get('specifications'))
+    for key, value in new_specs.items():
+        if key in old_specs and old_specs[key] != value:
+            pairs.append((old_specs[key], value))
+
+    pairs = [(old, new) for old, new in pairs if len(old) >= MIN_REPLACEMENT_LENGTH]
+    return sorted(dict(pairs).items(), key=lambda pair: -len(pair[0]))
+
+
+def patch(value, pairs: List[Tuple[str, str]]):
+    '''Заменяет старые значения новыми во всех строках анализа за один проход'''
+    if not pairs:
+        return value
+    mapping = dict(pairs)
+    pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(old) for old, _ in pairs) + r')(?!\w)')
+
+    def walk(item):
+        if isinstance(item, str):
+            return pattern.sub(lambda match: mapping[match.group(0)], item)
+        if isinstance(item, list):
+            return [walk(element) for element in item]
+        if isinstance(item, dict):
+            return {walk(key): walk(element) for key, element in item.items()}
+        return item
+
+    return walk(value)
+
+
+def find_variant(basic_data: Dict, url: str = '') -> Optional[Dict]:
+    '''
+    Ищет уже проанализированный вариант того же товара на другом URL.
+
+    Возвращает {'analysis', 'variant_of', 'similarity', 'patched'} с анализом,
+    в котором отличающиеся атрибуты заменены значениями текущей карточки.
+    '''
+    if not VARIANT_REUSE:
+        return None
+    feature_set = features(basic_data)
+    if len(feature_set) < MIN_FEATURES:
+        return None
+
+    sig = signature(feature_set)
+    best, best_score = None, 0.0
+    for candidate in variant_candidates(lsh_buckets(sig), normalize(basic_data.get('brand', '')), url):
+        score = similarity(sig, array('Q', candidate['signature']).tolist())
+        if score > best_score:
+            best, best_score = candidate, score
+
+    if best is None or best_score < VARIANT_THRESHOLD:
+        return None
+
+    pairs = replacements(best['basic_data'], basic_data)
+    return {
+        'analysis': patch(best['analysis'], pairs),
+        'variant_of': best['url'],
+        'similarity': round(best_score, 3),
+        'patched': [{'from': old, 'to': new} for old, new in pairs]
+    }
+
+
+def remember_analysis(url: str, basic_data: Dict, analysis: Dict) -> None:
+    '''Добавляет товар с полным AI-анализом в индекс вариантов'''
+    if not VARIANT_REUSE or not analysis:
+        return
+    feature_set = features(basic_data)
+    if len(feature_set) < MIN_FEATURES:
+        return
+    sig = signature(feature_set)
+    remember_variant(
+        url, normalize(basic_data.get('brand', '')), basic_data,
+        array('Q', sig).tobytes(), analysis, lsh_buckets(sig)
+    )
@@ -0,0 +1,339 @@
+'''
+Локальный HTTP-сервер для функций backend/ без облака: запрос превращается
+в event, который ожидает handler(event, context), и обслуживается пулом потоков
+за асинхронным фронтом. Модули функции загружаются один раз, поэтому клиенты
+OpenAI/S3, пулы соединений, кэши и состояние SQLite остаются "теплыми"
+между запросами.
+
+Одна функция на процесс: у функций одинаковые имена модулей (index, state, tracing).
+
+    python backend/server.py seo-analyzer --port 8001
+    python backend/server.py media-generate --port 8002 --workers 32
+
+GET /healthz — состояние сервера (запросы в работе, обслужено, отклонено).
+SIGTERM/SIGINT — прием новых соединений прекращается, начатые запросы
+дорабатывают до --shutdown-timeout, затем вызывается shutdown() функции.
+'''
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS = ('seo-analyzer', 'media-generate')
+
+# Обработчики в основном ждут сеть (магазины, OpenAI, S3), поэтому потоков
+# больше, чем ядер
+DEFAULT_WORKERS = int(os.environ.get('SERVER_WORKERS', '64'))
+# Запросов в работе и в очереди пула; сверх этого сразу 503 (0 — 4 × workers)
+DEFAULT_MAX_PENDING = int(os.environ.get('SERVER_MAX_PENDING', '0'))
+MAX_BODY_BYTES = int(float(os.environ.get('SERVER_MAX_BODY_MB', '10')) * 1024 * 1024)
+MAX_HEADER_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '15'))
+SHUTDOWN_TIMEOUT = float(os.environ.get('SERVER_SHUTDOWN_TIMEOUT', '30'))
+
+
+class BadRequest(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def load_function(name: str):
+    '''Импортирует index.py функции так же, как платформа: каталог функции в начале sys.path'''
+    function_dir = os.path.join(BACKEND_DIR, name)
+    if not os.path.isfile(os.path.join(function_dir, 'index.py')):
+        raise SystemExit(f'Функция не найдена: {function_dir}')
+    sys.path.insert(0, function_dir)
+    return importlib.import_module('index')
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes, peer: str) -> dict:
+    '''HTTP-запрос в формате event облачной функции'''
+    parts = urllib.parse.urlsplit(target)
+    pairs = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    multi_params: Dict[str, list] = {}
+    for key, value in pairs:
+        multi_params.setdefault(key, []).append(value)
+
+    try:
+        text, encoded = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode('ascii'), True
+
+    return {
+        'httpMethod': method,
+        'path': parts.path or '/',
+        'headers': headers,
+        'multiValueHeaders': {key: [value] for key, value in headers.items()},
+        'queryStringParameters': dict(pairs),
+        'multiValueQueryStringParameters': multi_params,
+        'requestContext': {
+            'requestId': uuid.uuid4().hex,
+            'httpMethod': method,
+            'identity': {'sourceIp': peer}
+        },
+        'body': text,
+        'isBase64Encoded': encoded
+    }
+
+
+def encode_response(response: dict, keep_alive: bool, head: bool = False) -> bytes:
+    status = int(response.get('statusCode', 200))
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        payload = base64.b64decode(body)
+    elif isinstance(body, bytes):
+        payload = body
+    else:
+        payload = str(body).encode('utf-8')
+
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    lines = [f'HTTP/1.1 {status} {reason}']
+    for key, value in (response.get('headers') or {}).items():
+        if key.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+            lines.append(f'{key}: {value}')
+    lines.append(f'Content-Length: {len(payload)}')
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    head_bytes = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+    return head_bytes if head else head_bytes + payload
+
+
+def json_response(status: int, data: dict, headers: Optional[dict] = None) -> dict:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps(data, ensure_ascii=False)
+    }
+
+
+class FunctionServer:
+    def __init__(self, name: str, module, workers: int = DEFAULT_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING, shutdown_timeout: float = SHUTDOWN_TIMEOUT):
+        self.name = name
+        self.module = module
+        self.handler = module.handler
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{name}-worker')
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self.started_at = time.time()
+        self.connections: Dict[asyncio.StreamWriter, bool] = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stopping = False
+
+    def call_handler(self, event: dict) -> dict:
+        context = SimpleNamespace(
+            request_id=event['requestContext']['requestId'],
+            function_name=self.name,
+            function_version='local'
+        )
+        try:
+            return self.handler(event, context)
+        except Exception as e:
+            traceback.print_exc()
+            return json_response(500, {'error': str(e)})
+
+    def health(self) -> dict:
+        return json_response(200, {
+            'function': self.name,
+            'status': 'stopping' if self.stopping else 'ok',
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'served': self.served,
+            'rejected': self.rejected,
+            'uptime_s': round(time.time() - self.started_at, 1)
+        })
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+        '''None — клиент закрыл соединение между запросами'''
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise BadRequest(400, 'Incomplete request')
+            return None
+        except asyncio.LimitOverrunError:
+            raise BadRequest(431, 'Request header fields too large')
+        except asyncio.TimeoutError:
+            return None
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise BadRequest(400, 'Malformed request line')
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            key, sep, value = line.partition(':')
+            if not sep:
+                raise BadRequest(400, 'Malformed header')
+            key, value = key.strip(), value.strip()
+            # Заголовки обработчиков читаются в каноническом виде (Content-Type, X-Debug-Timing)
+            key = '-'.join(part.capitalize() for part in key.split('-'))
+            headers[key] = f'{headers[key]}, {value}' if key in headers else value
+
+        return method, target, version, headers
+
+    async def read_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        headers: Dict[str, str]) -> bytes:
+        chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        length = headers.get('Content-Length')
+        if not chunked and not length:
+            return b''
+        if length and int(length) > MAX_BODY_BYTES:
+            raise BadRequest(413, 'Request body too large')
+        if headers.get('Expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        if not chunked:
+            return await reader.readexactly(int(length))
+
+        body = bytearray()
+        while True:
+            size_line = await reader.readuntil(b'\r\n')
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Завершающие заголовки (trailers) не нужны обработчикам
+                while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                    pass
+                return bytes(body)
+            if len(body) + size > MAX_BODY_BYTES:
+                raise BadRequest(413, 'Request body too large')
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = (writer.get_extra_info('peername') or ('', 0))[0]
+        self.connections[writer] = False
+        try:
+            while not self.stopping:
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers = request
+                    body = await self.read_body(reader, writer, headers)
+                except BadRequest as e:
+                    writer.write(encode_response(json_response(e.status, {'error': str(e)}), keep_alive=False))
+                    await writer.drain()
+                    break
+                except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    writer.write(encode_response(json_response(400, {'error': 'Malformed request'}), keep_alive=False))
+                    await writer.drain()
+                    break
+
+                connection = headers.get('Connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                self.connections[writer] = True
+                response = await self.dispatch(method, target, headers, body, peer)
+                self.connections[writer] = False
+
+                keep_alive = keep_alive and not self.stopping
+                writer.write(encode_response(response, keep_alive, head=method == 'HEAD'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes, peer: str) -> dict:
+        if target.split('?', 1)[0] == '/healthz' and method in ('GET', 'HEAD'):
+            return self.health()
+        if self.stopping or self.in_flight >= self.max_pending:
+            self.rejected += 1
+            return json_response(503, {'error': 'Server is busy'}, {'Retry-After': '1'})
+
+        event = build_event(method, target, headers, body, peer)
+        self.in_flight += 1
+        self.idle.clear()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.call_handler, event)
+        finally:
+            self.in_flight -= 1
+            self.served += 1
+            if self.in_flight == 0:
+                self.idle.set()
+
+    async def run(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(
+            self.serve_connection, host, port, limit=MAX_HEADER_BYTES, backlog=1024
+        )
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        addresses = ', '.join(f'http://{sock.getsockname()[0]}:{sock.getsockname()[1]}' for sock in server.sockets)
+        print(f'{self.name}: {addresses} ({self.workers} потоков)', flush=True)
+
+        await stop.wait()
+        print(f'{self.name}: остановка, запросов в работе: {self.in_flight}', flush=True)
+        self.stopping = True
+        server.close()
+        # Простаивающие keep-alive соединения закрываются сразу, занятые — после ответа
+        for writer, busy in list(self.connections.items()):
+            if not busy:
+                writer.close()
+        try:
+            await asyncio.wait_for(self.idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            print(f'{self.name}: не дождались {self.in_flight} запросов за {self.shutdown_timeout:.0f} с', flush=True)
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        shutdown = getattr(self.module, 'shutdown', None)
+        if shutdown is not None:
+            await loop.run_in_executor(None, shutdown)
+        print(f'{self.name}: остановлен, обслужено запросов: {self.served}', flush=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('function', choices=FUNCTIONS, help='каталог функции в backend/')
+    parser.add_argument('--host', default=os.environ.get('SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVER_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='потоков для обработчиков')
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help='запросов в работе и очереди, сверх — 503 (по умолчанию 4 × workers)')
+    parser.add_argument('--shutdown-timeout', type=float, default=SHUTDOWN_TIMEOUT,
+                        help='сколько ждать начатые запросы при остановке, секунд')
+    args = parser.parse_args()
+
+    module = load_function(args.function)
+    server = FunctionServer(
+        args.function, module, workers=args.workers,
+        max_pending=args.max_pending,
+        shutdown_timeout=args.shutdown_timeout
+    )
+    asyncio.run(server.run(args.host, args.port))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
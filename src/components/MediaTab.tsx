@@ -152,16 +152,23 @@ const MediaTab = () => {
   };
 
   const pollVideoStatus = async (taskId: string, mediaId: string) => {
-    const maxAttempts = 60; // 5 минут максимум (60 * 5 секунд)
+    const maxAttempts = 15; // 5 минут максимум (15 long-poll запросов по 20 секунд)
     let attempts = 0;
 
     const checkStatus = async () => {
       try {
         const response = await fetch(
-          `https://functions.poehali.dev/4a12359f-155b-452d-a3f3-48b495c6444c?task_id=${taskId}`,
+          `https://functions.poehali.dev/4a12359f-155b-452d-a3f3-48b495c6444c?task_id=${taskId}&wait=20`,
           { method: 'GET' }
         );
 
+        if (response.status === 404) {
+          // Runway не знает такой задачи: повторять бессмысленно
+          setGeneratedMedia(prev => prev.filter(m => m.id !== mediaId));
+          toast.error('Задача генерации видео не найдена');
+          return true;
+        }
+
         const data = await response.json();
 
         if (data.status === 'completed' && data.url) {
@@ -201,8 +208,9 @@ const MediaTab = () => {
           return true;
         }
 
-        // Проверяем снова через 5 секунд
-        setTimeout(checkStatus, 5000);
+        // Сервер сам ждет завершения до 20 секунд, поэтому после ответа processing повторяем
+        // почти сразу; другой ответ пришел без ожидания — пауза как при ошибке сети
+        setTimeout(checkStatus, data.status === 'processing' ? 1000 : 5000);
         return false;
 
       } catch (error) {